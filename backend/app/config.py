@@ -1,4 +1,4 @@
-import os
+from functools import lru_cache
 from pathlib import Path
 from pydantic import BaseSettings
 from typing import Optional
@@ -11,20 +11,43 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     
     # OpenAI API
-    OPENAI_API_KEY: Optional[str] = os.environ.get("OPENAI_API_KEY")
+    OPENAI_API_KEY: Optional[str] = None
     
     # LAMMPS configuration
-    LAMMPS_SERVICE: Optional[str] = os.environ.get("LAMMPS_SERVICE")
-    LAMMPS_VOLUME: Optional[str] = os.environ.get("LAMMPS_VOLUME", "/simulations")
+    LAMMPS_SERVICE: Optional[str] = None
+    LAMMPS_VOLUME: Optional[str] = "/simulations"
+    
+    # Simulations run at once; by default sized from the available cores
+    SIM_CONCURRENCY: Optional[int] = None
     
     # Temporary directory for storing simulation files
-    TEMP_DIR: Path = Path(os.environ.get("TEMP_DIR", "/tmp/lammps_simulations"))
+    TEMP_DIR: Path = Path("/tmp/lammps_simulations")
+    
+    # Directory LAMMPS runs in, defaulting to the LAMMPS service's simulations directory.
+    # A tmpfs path keeps simulation I/O in memory, but must be larger than the biggest
+    # trajectory, and kept outputs are then copied rather than renamed into place
+    SCRATCH_DIR: Optional[Path] = None
+    
+    # Minimum free space in SCRATCH_DIR before a warning is logged at startup (1 GiB)
+    SCRATCH_DIR_MIN_FREE: int = 1 << 30
     
     class Config:
         env_file = ".env"
 
-# Create global settings object
-settings = Settings()
-
-# Create TEMP_DIR if it doesn't exist
-settings.TEMP_DIR.mkdir(parents=True, exist_ok=True)
+@lru_cache()
+def get_settings() -> Settings:
+    """
+    Get the application settings.
+    
+    The settings are read from the environment once and cached, so this can be
+    used as a cheap FastAPI dependency.
+    
+    Returns:
+        Settings: The application settings.
+    """
+    settings = Settings()
+    
+    # Create TEMP_DIR if it doesn't exist
+    settings.TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    
+    return settings
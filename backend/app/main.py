@@ -1,17 +1,26 @@
 import os
-import tempfile
+import asyncio
 import logging
 from pathlib import Path
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Response, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
-import re
-import uuid
+from typing import Dict, Any, Optional, List, Tuple
+import itertools
+import codecs
+import functools
+import secrets
 import json
+import orjson
 import shutil
+import time
+import heapq
+import threading
 from dotenv import load_dotenv
-import math
+import aiofiles
+import numpy as np
+from cachetools import TTLCache
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,6 +29,7 @@ from app.services.lammps_service import LAMMPSService
 from app.services.ase_service import ASEService
 from app.services.openai_service import OpenAIService
 from app.services.db_service import DBService
+from app.config import get_settings
 
 # Configure logging
 logging.basicConfig(
@@ -33,6 +43,7 @@ app = FastAPI(
     title="LAMMPS Simulation API",
     description="API for running molecular dynamics simulations with LAMMPS and analyzing results",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -44,21 +55,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Load settings
+settings = get_settings()
+
 # Initialize services
-lammps_service = LAMMPSService()
+lammps_service = LAMMPSService(max_workers=settings.SIM_CONCURRENCY, scratch_dir=settings.SCRATCH_DIR)
 ase_service = ASEService()
 openai_service = OpenAIService()
 db_service = DBService()
 
-# Temporary directory for storing simulation files
-TEMP_DIR = Path(tempfile.gettempdir()) / "lammps_simulations"
+# Temporary directory for storing uploaded potentials and simulation inputs; LAMMPS itself
+# runs in the service's scratch directory (set SCRATCH_DIR to put that on tmpfs)
+TEMP_DIR = settings.TEMP_DIR
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
-# Dictionary to store trajectory file paths by ID
-trajectory_files_by_id = {}
+# Maximum age of a simulation directory before it is cleaned up (24 hours)
+SIM_MAX_AGE = 86400
+
+# Min-heap of (creation time, directory) for simulation directories awaiting cleanup,
+# seeded once from the directories left over by previous runs
+_SIM_HEAP: List[Tuple[float, Path]] = [
+    (entry.stat().st_mtime, entry) for entry in TEMP_DIR.iterdir() if entry.is_dir()
+]
+heapq.heapify(_SIM_HEAP)
+_SIM_LOCK = threading.Lock()
+
+# Process-local ID generator for internal directory names: random per-process prefix plus a monotonic counter
+_ID_PREFIX = secrets.token_hex(4)
+_ID_COUNTER = itertools.count()
 
-# Dictionary to store potential files by ID
-potential_files_by_id = {}
+# Chat sessions by session ID as (owner user ID, conversation history), evicted after an hour of inactivity
+_CHAT_SESSIONS: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# Chunk size used when streaming uploaded files to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Prompt fragments used to inline potential file content into generation requests
+_POTENTIAL_PROMPT_PREFIX = "\n\nI have a potential file named '"
+_POTENTIAL_PROMPT_CONTENT = "' with the following content:\n\n```\n"
+_POTENTIAL_PROMPT_SUFFIX = (
+    "\n```\n\n"
+    "Please generate a LAMMPS input file that directly incorporates the parameters from this potential file "
+    "into the input script, rather than using include or read_data commands. The parameters should be "
+    "integrated directly into the appropriate LAMMPS commands in the input file.\n"
+)
 
 # Data models
 class InputFileRequest(BaseModel):
@@ -85,10 +125,181 @@ class InputFileResponse(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     conversation_history: Optional[List[Dict[str, str]]] = None
+    session_id: Optional[str] = None  # ID of a server-side conversation to continue
 
 class ChatResponse(BaseModel):
     response: str
-    conversation_history: List[Dict[str, str]]
+    conversation_history: Optional[List[Dict[str, str]]] = None  # Only returned to stateless clients
+    session_id: Optional[str] = None  # ID to continue the conversation without resending history
+
+# Helper functions
+def _new_id() -> str:
+    """Generate a unique ID for simulation directories created by this process (not for public IDs)."""
+    return f"{_ID_PREFIX}{next(_ID_COUNTER):012x}"
+
+def _new_file_id() -> str:
+    """Generate an unguessable ID for an uploaded file, as it is handed back to clients."""
+    return secrets.token_hex(16)
+
+def _new_session_id() -> str:
+    """Generate an unguessable ID for a server-side chat session."""
+    return secrets.token_urlsafe(32)
+
+def _resolve_chat_session(chat_request: ChatRequest, user_id: Optional[str]) -> Tuple[str, List[Dict[str, str]], bool]:
+    """
+    Find the conversation a chat request continues.
+    
+    A stored session is only used when it belongs to the requesting user. If the
+    session is unknown, expired or owned by someone else, the history sent with
+    the request starts a new session instead; without one the client is asked to
+    resend it.
+    
+    Args:
+        chat_request (ChatRequest): The incoming chat request.
+        user_id (str, optional): The ID of the user making the request.
+    
+    Returns:
+        tuple: The session ID, the conversation history so far, and whether the
+            history came from the request rather than the server.
+    
+    Raises:
+        HTTPException: 404 if the session cannot be continued and no history was sent.
+    """
+    session_id = chat_request.session_id
+    session = _CHAT_SESSIONS.get(session_id) if session_id else None
+    if session is not None and session[0] == user_id:
+        return session_id, session[1], False
+    if session_id and chat_request.conversation_history is None:
+        raise HTTPException(status_code=404, detail="Chat session not found; resend the conversation history")
+    return _new_session_id(), chat_request.conversation_history or [], True
+
+def _fast_clone(src: Path, dst: Path) -> None:
+    """
+    Clone a read-only file into a simulation directory without a user-space copy.
+    
+    LAMMPS only ever reads potential files, so a hard link to the uploaded file is
+    safe. When linking is not possible (e.g. across devices), fall back to in-kernel
+    copies before resorting to shutil.copyfile.
+    
+    Args:
+        src (Path): The file to clone.
+        dst (Path): The destination path.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        size = src.stat().st_size
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                copied = 0
+                if hasattr(os, "copy_file_range"):
+                    try:
+                        while copied < size:
+                            n = os.copy_file_range(s.fileno(), d.fileno(), size - copied)
+                            if n == 0:
+                                break
+                            copied += n
+                    except OSError:
+                        pass
+                while copied < size:
+                    n = os.sendfile(d.fileno(), s.fileno(), copied, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+        except OSError:
+            shutil.copyfile(src, dst)
+    
+    # Potential files are shared between simulations and must never be modified
+    os.chmod(dst, 0o444)
+
+def _json_safe(values):
+    """
+    Convert a sequence of floats to a JSON-compatible list.
+    
+    NaN, infinite and None entries are mapped to None.
+    
+    Args:
+        values (list): The values to convert.
+        
+    Returns:
+        list: The converted values.
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    result = arr.tolist()
+    for i in np.flatnonzero(~np.isfinite(arr)):
+        result[i] = None
+    return result
+
+def _resolve_potential_path(file_id: str) -> Path:
+    """
+    Resolve the on-disk path of an uploaded potential file.
+    
+    Args:
+        file_id (str): The ID returned by the upload endpoint.
+        
+    Returns:
+        Path: The path to the potential file.
+        
+    Raises:
+        HTTPException: If no potential file exists for the ID.
+    """
+    file_path = TEMP_DIR / f"potential_{file_id}"
+    if Path(file_id).name != file_id or not file_path.exists():
+        raise HTTPException(status_code=404, detail="Potential file not found")
+    return file_path
+
+@functools.lru_cache(maxsize=64)
+def _read_potential_cached(path_str: str, mtime_ns: int) -> str:
+    """
+    Read a potential file, caching the content by path and modification time.
+    
+    Args:
+        path_str (str): The path to the potential file.
+        mtime_ns (int): The file's modification time, so replaced files are re-read.
+        
+    Returns:
+        str: The content of the potential file.
+    """
+    return Path(path_str).read_text()
+
+def _resolve_trajectory_path(file_id: str) -> Path:
+    """
+    Resolve the on-disk path of a trajectory file produced by a simulation.
+    
+    Args:
+        file_id (str): The trajectory file ID returned with the simulation results.
+        
+    Returns:
+        Path: The path to the trajectory file.
+        
+    Raises:
+        HTTPException: If no trajectory file exists for the ID.
+    """
+    file_path = lammps_service.simulations_dir / f"trajectory_{file_id}.xyz"
+    if Path(file_id).name != file_id or not file_path.exists():
+        raise HTTPException(status_code=404, detail="Trajectory file not found")
+    return file_path
+
+# Application lifecycle
+@app.on_event("startup")
+async def startup():
+    """Check the scratch directory before serving requests."""
+    # Warn if the scratch directory is too small for the simulation working set
+    stat = os.statvfs(lammps_service.scratch_dir)
+    free_bytes = stat.f_bavail * stat.f_frsize
+    if free_bytes < settings.SCRATCH_DIR_MIN_FREE:
+        logger.warning(
+            f"Only {free_bytes / (1 << 20):.0f} MiB free in {lammps_service.scratch_dir}; "
+            f"at least {settings.SCRATCH_DIR_MIN_FREE / (1 << 20):.0f} MiB is recommended"
+        )
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the services' pooled HTTP clients and their worker pools."""
+    await db_service.aclose()
+    await openai_service.aclose()
+    lammps_service.close()
+    ase_service.close()
 
 # Health check endpoint
 @app.get("/health")
@@ -100,37 +311,41 @@ async def health_check():
 async def upload_potential_file(file: UploadFile = File(...), user_id: Optional[str] = Header(None)):
     """Upload a potential file for use in LAMMPS simulations."""
     try:
-        # Read the file content
-        content = await file.read()
-        content_str = content.decode("utf-8")
-        
         # Generate a unique ID for the file
-        file_id = str(uuid.uuid4())
+        file_id = _new_file_id()
         
-        # Save the file to disk
+        # Stream the upload to disk in fixed-size chunks, checking it is UTF-8 text and
+        # decoding it for the database record in the same pass instead of reading it back
         file_path = Path(TEMP_DIR) / f"potential_{file_id}"
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        parts = []
         
-        # Store the file path for later use
-        potential_files_by_id[file_id] = str(file_path)
+        try:
+            async with aiofiles.open(file_path, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+                    text = decoder.decode(chunk)
+                    if db_service:
+                        parts.append(text)
+                parts.append(decoder.decode(b"", final=True))
+        except UnicodeDecodeError as e:
+            file_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail=f"Potential file is not valid UTF-8 text: {str(e)}")
         
         # Save to database
         if db_service:
             try:
                 db_result = await db_service.save_potential_file(
                     filename=file.filename,
-                    content=content_str,
+                    content="".join(parts),
                     file_path=str(file_path),
                     user_id=user_id
                 )
                 logger.info(f"Saved potential file to database with ID: {db_result.get('id')}")
-                # Use the database ID instead if available
+                # Use the database ID instead if available, linking the file under that ID
                 if db_result and "id" in db_result:
+                    os.link(file_path, TEMP_DIR / f"potential_{db_result['id']}")
                     file_id = db_result["id"]
-                    potential_files_by_id[file_id] = str(file_path)
             except Exception as e:
                 logger.warning(f"Failed to save potential file to database: {str(e)}")
         
@@ -140,6 +355,8 @@ async def upload_potential_file(file: UploadFile = File(...), user_id: Optional[
             "potential_file_id": file_id,
             "filename": file.filename
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error uploading potential file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
@@ -151,56 +368,63 @@ async def run_lammps(input_file: InputFileRequest, user_id: Optional[str] = Head
     if not input_file.input_content:
         raise HTTPException(status_code=400, detail="Empty input file")
     
+    potential_file_path = None
+    if input_file.potential_file_id:
+        potential_file_path = _resolve_potential_path(input_file.potential_file_id)
+    
     try:
-        # Create a temporary directory for the simulation
-        sim_id = os.urandom(4).hex()
+        # Create a temporary directory for the simulation (TEMP_DIR is created at startup)
+        sim_id = _new_id()
         sim_dir = Path(TEMP_DIR) / f"sim_{sim_id}"
-        sim_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.mkdir(sim_dir)
+        except FileExistsError:
+            # Retry once with a fresh ID on the rare collision
+            sim_id = _new_id()
+            sim_dir = Path(TEMP_DIR) / f"sim_{sim_id}"
+            os.mkdir(sim_dir)
+        
+        # Register the directory for cleanup
+        with _SIM_LOCK:
+            heapq.heappush(_SIM_HEAP, (time.time(), sim_dir))
         
         # Create the input file
         input_file_path = sim_dir / "input.lammps"
-        with open(input_file_path, "w") as f:
-            f.write(input_file.input_content)
+        async with aiofiles.open(input_file_path, "w") as f:
+            await f.write(input_file.input_content)
         
-        # Save to database
-        db_input_id = None
-        if db_service:
+        async def _record_simulation():
+            """Save the input and create the simulation record, returning the simulation ID."""
             try:
-                # Save the input file
-                input_result = await db_service.save_simulation_input(
+                sim_result = await db_service.create_simulation_with_input(
                     content=input_file.input_content,
                     name=f"Simulation {sim_id}",
                     potential_file_id=input_file.potential_file_id,
                     user_id=user_id
                 )
-                logger.info(f"Saved simulation input to database with ID: {input_result.get('id')}")
-                db_input_id = input_result.get("id")
+                logger.info(
+                    f"Created simulation record in database with ID: {sim_result.get('id')} "
+                    f"(input ID: {(sim_result.get('input') or {}).get('id')})"
+                )
+                return sim_result.get("id")
             except Exception as e:
-                logger.warning(f"Failed to save simulation input to database: {str(e)}")
+                logger.warning(f"Failed to save simulation to database: {str(e)}")
+                return None
+        
+        # Save to database in the background while the simulation is prepared and run
+        db_task = asyncio.create_task(_record_simulation()) if db_service else None
         
         # Copy potential file if provided
-        if input_file.potential_file_id and input_file.potential_file_id in potential_files_by_id:
-            potential_file_path = Path(potential_files_by_id[input_file.potential_file_id])
-            if potential_file_path.exists():
-                # Copy to simulation directory with original filename
-                shutil.copy(potential_file_path, sim_dir / potential_file_path.name)
-                logger.info(f"Copied potential file {potential_file_path.name} to simulation directory")
-        
-        # Create simulation record in database
-        db_simulation_id = None
-        if db_service and db_input_id:
-            try:
-                sim_result = await db_service.create_simulation(
-                    input_id=db_input_id,
-                    user_id=user_id
-                )
-                logger.info(f"Created simulation record in database with ID: {sim_result.get('id')}")
-                db_simulation_id = sim_result.get("id")
-            except Exception as e:
-                logger.warning(f"Failed to create simulation record in database: {str(e)}")
+        if potential_file_path:
+            # Clone into the simulation directory with original filename
+            _fast_clone(potential_file_path, sim_dir / potential_file_path.name)
+            logger.info("Copied potential file %s to simulation directory", potential_file_path.name)
         
         # Run the simulation
-        result = lammps_service.run_simulation(input_file_path)
+        result = await lammps_service.run_simulation_async(input_file_path)
+        
+        # Wait for the database records
+        db_simulation_id = await db_task if db_task else None
         
         if not result["success"]:
             logger.error(f"Simulation failed: {result['message']}")
@@ -247,10 +471,10 @@ async def run_lammps(input_file: InputFileRequest, user_id: Optional[str] = Head
         
         # Convert NaN values to None for JSON compatibility
         if msd is not None:
-            msd = [None if (x is None or (isinstance(x, float) and (math.isnan(x) or math.isinf(x)))) else x for x in msd]
+            msd = _json_safe(msd)
         
         if kinetic_energy is not None:
-            kinetic_energy = [None if (x is None or (isinstance(x, float) and (math.isnan(x) or math.isinf(x)))) else x for x in kinetic_energy]
+            kinetic_energy = _json_safe(kinetic_energy)
         
         # Return the analysis results
         return SimulationResponse(
@@ -268,25 +492,15 @@ async def run_lammps(input_file: InputFileRequest, user_id: Optional[str] = Head
 # Endpoint to get trajectory file content
 @app.get("/trajectory/{file_id}")
 async def get_trajectory_file(file_id: str):
-    """Get the content of a trajectory file by ID."""
-    if file_id not in trajectory_files_by_id:
-        raise HTTPException(status_code=404, detail="Trajectory file not found")
+    """Download a trajectory file by ID."""
+    file_path = _resolve_trajectory_path(file_id)
     
-    try:
-        file_path = trajectory_files_by_id[file_id]
-        with open(file_path, 'r') as f:
-            content = f.read()
-        
-        return Response(
-            content=content,
-            media_type="text/plain",
-            headers={
-                "Content-Disposition": f"attachment; filename=trajectory.xyz"
-            }
-        )
-    except Exception as e:
-        logger.exception(f"Error reading trajectory file: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error reading trajectory file: {str(e)}")
+    # Stream the file from disk instead of loading it into memory
+    return FileResponse(
+        file_path,
+        media_type="text/plain",
+        filename="trajectory.xyz"
+    )
 
 # Generate LAMMPS input file from natural language
 @app.post("/generate-input/", response_model=InputFileResponse)
@@ -296,44 +510,45 @@ async def generate_lammps_input(prompt_request: NLPromptRequest):
     if not prompt_request.prompt:
         raise HTTPException(status_code=400, detail="Empty prompt")
     
+    potential_file_path = None
+    if prompt_request.potential_file_id:
+        potential_file_path = _resolve_potential_path(prompt_request.potential_file_id)
+    
     try:
         # Get potential file content if provided
         potential_file_content = None
         potential_file_name = None
         
-        if prompt_request.potential_file_id and prompt_request.potential_file_id in potential_files_by_id:
-            potential_file_path = Path(potential_files_by_id[prompt_request.potential_file_id])
+        if potential_file_path:
             potential_file_name = potential_file_path.name
             
             # Read the content of the potential file
-            if potential_file_path.exists():
-                try:
-                    with open(potential_file_path, 'r') as f:
-                        potential_file_content = f.read()
-                    logger.info(f"Read potential file: {potential_file_name}")
-                except Exception as e:
-                    logger.error(f"Error reading potential file: {str(e)}")
+            try:
+                potential_file_content = _read_potential_cached(
+                    str(potential_file_path), potential_file_path.stat().st_mtime_ns
+                )
+                logger.info(f"Read potential file: {potential_file_name}")
+            except Exception as e:
+                logger.error(f"Error reading potential file: {str(e)}")
             
             # Enhance prompt with potential file information and content
             if potential_file_content:
-                enhanced_prompt = f"""
-{prompt_request.prompt}
-
-I have a potential file named '{potential_file_name}' with the following content:
-
-```
-{potential_file_content}
-```
-
-Please generate a LAMMPS input file that directly incorporates the parameters from this potential file into the input script, rather than using include or read_data commands. The parameters should be integrated directly into the appropriate LAMMPS commands in the input file.
-"""
+                enhanced_prompt = "".join((
+                    "\n",
+                    prompt_request.prompt,
+                    _POTENTIAL_PROMPT_PREFIX,
+                    potential_file_name,
+                    _POTENTIAL_PROMPT_CONTENT,
+                    potential_file_content,
+                    _POTENTIAL_PROMPT_SUFFIX,
+                ))
             else:
                 enhanced_prompt = f"{prompt_request.prompt}\n\nUse the potential file named '{potential_file_name}' in the simulation."
         else:
             enhanced_prompt = prompt_request.prompt
         
         # Generate input file
-        input_content = openai_service.generate_lammps_input(enhanced_prompt)
+        input_content = await openai_service.generate_lammps_input(enhanced_prompt)
         
         # Return the result
         return InputFileResponse(
@@ -346,53 +561,92 @@ Please generate a LAMMPS input file that directly incorporates the parameters fr
 
 # Chat with LAMMPS assistant
 @app.post("/chat/", response_model=ChatResponse)
-async def chat_with_assistant(chat_request: ChatRequest):
+async def chat_with_assistant(chat_request: ChatRequest, user_id: Optional[str] = Header(None)):
     """Chat with a LAMMPS simulation assistant."""
     
     if not chat_request.message:
         raise HTTPException(status_code=400, detail="Empty message")
     
+    # Continue a server-side session if one is given, otherwise start from the provided history
+    session_id, conversation_history, stateless = _resolve_chat_session(chat_request, user_id)
+    
     try:
-        # Initialize conversation history if not provided
-        conversation_history = chat_request.conversation_history or []
-        
-        # Add user message to history
-        conversation_history.append({"role": "user", "content": chat_request.message})
+        # Add user message to a copy of the history, so a failed reply leaves the session untouched
+        conversation_history = conversation_history + [{"role": "user", "content": chat_request.message}]
         
         # Call OpenAI API for chat response
-        response = openai_service.chat_with_assistant(conversation_history)
+        response = await openai_service.chat_with_assistant(conversation_history)
         
-        # Add assistant response to history
+        # Add assistant response to history and store it for the next turn
         conversation_history.append({"role": "assistant", "content": response})
+        _CHAT_SESSIONS[session_id] = (user_id, conversation_history)
         
-        # Return the result
+        # Return the result, echoing the full history only to stateless clients
         return ChatResponse(
             response=response,
-            conversation_history=conversation_history
+            conversation_history=conversation_history if stateless else None,
+            session_id=session_id
         )
     except Exception as e:
         logger.exception("Error in chat with assistant")
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
+# Chat with LAMMPS assistant, streaming the response as server-sent events
+@app.post("/chat/stream/")
+async def stream_chat_with_assistant(chat_request: ChatRequest, user_id: Optional[str] = Header(None)):
+    """
+    Chat with a LAMMPS simulation assistant, streaming tokens as they are generated.
+    
+    The first event carries the session ID, each following event a piece of the
+    response as {"delta": ...}, and the stream ends with [DONE].
+    """
+    
+    if not chat_request.message:
+        raise HTTPException(status_code=400, detail="Empty message")
+    
+    # Continue a server-side session if one is given, otherwise start from the provided history
+    session_id, conversation_history, _ = _resolve_chat_session(chat_request, user_id)
+    
+    # Add user message to a copy of the history, so a failed reply leaves the session untouched
+    conversation_history = conversation_history + [{"role": "user", "content": chat_request.message}]
+    
+    async def events():
+        yield b"data: " + orjson.dumps({"session_id": session_id}) + b"\n\n"
+        parts = []
+        try:
+            async for content in openai_service.stream_chat_with_assistant(conversation_history):
+                parts.append(content)
+                yield b"data: " + orjson.dumps({"delta": content}) + b"\n\n"
+        except Exception as e:
+            logger.exception("Error in streaming chat with assistant")
+            yield b"data: " + orjson.dumps({"error": f"Error in chat: {str(e)}"}) + b"\n\n"
+            return
+        
+        # Add assistant response to history and store it for the next turn
+        conversation_history.append({"role": "assistant", "content": "".join(parts).strip()})
+        _CHAT_SESSIONS[session_id] = (user_id, conversation_history)
+        yield b"data: [DONE]\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # Clean up old simulations
 @app.post("/cleanup/", status_code=204)
 async def cleanup_simulations(background_tasks: BackgroundTasks):
     """Clean up old simulation files."""
     
-    def _cleanup():
+    def _cleanup(_time=time.time, _rmtree=shutil.rmtree, _max_age=SIM_MAX_AGE):
         """Cleanup function to be run in the background."""
         try:
-            # Delete directories older than 24 hours
-            import time
-            current_time = time.time()
+            # Pop directories older than 24 hours off the heap
+            cutoff = _time() - _max_age
+            expired = []
+            with _SIM_LOCK:
+                while _SIM_HEAP and _SIM_HEAP[0][0] < cutoff:
+                    expired.append(heapq.heappop(_SIM_HEAP)[1])
             
-            for sim_dir in TEMP_DIR.iterdir():
-                if sim_dir.is_dir():
-                    # Check if directory is older than 24 hours
-                    if current_time - sim_dir.stat().st_mtime > 86400:
-                        # Delete the directory
-                        import shutil
-                        shutil.rmtree(sim_dir)
+            # Delete the directories
+            for sim_dir in expired:
+                _rmtree(sim_dir, ignore_errors=True)
         except Exception as e:
             logger.error(f"Error cleaning up simulations: {str(e)}")
     
@@ -404,4 +658,14 @@ async def cleanup_simulations(background_tasks: BackgroundTasks):
 # Main entry point
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_keep_alive=300)
+    # Run a single worker: chat sessions and the simulation registry live in process
+    # memory, and simulations already fan out across cores in their own pool
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop when installed (not on Windows)
+        http="httptools",
+        access_log=False,
+        timeout_keep_alive=300
+    )
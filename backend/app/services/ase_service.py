@@ -1,155 +1,493 @@
+import os
+import mmap
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 import numpy as np
 import logging
 from pathlib import Path
-from ase.io import read
+from ase.io import iread
 import matplotlib.pyplot as plt
 from ase import Atoms
 import re
 
+# Number of frames stacked at a time when streaming a trajectory
+FRAME_CHUNK_SIZE = 256
+
+# Velocity dumps at least this large are parsed in a process pool
+VELOCITY_PARALLEL_MIN_SIZE = 64 << 20
+
+# Worker processes per velocity parse, matching the cores each simulation is given
+# (THREADS_PER_SIMULATION) so concurrent analyses do not oversubscribe the machine
+VELOCITY_PARALLEL_WORKERS = 4
+
+# Frames sent to a worker process per task; at most twice as many batches as workers are in flight
+VELOCITY_BATCH_SIZE = 16
+
+# Stands in for a velocity frame that could not be parsed, so later frames stay aligned with
+# the trajectory; it matches no atom count, so the frame's own kinetic energy is used instead
+_MISSING_VELOCITY_FRAME = np.full((0, 3), np.nan)
+
+# Element symbols indexed by LAMMPS atom type; unknown types map to 'X'
+_TYPE_TO_SYMBOL = (
+    'X',
+    'Ar',  # 例: 一般的なLJシミュレーションでは1をArgonとする
+    'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
+)
+
+# LAMMPS dump section headers, matched against raw byte lines
+_ITEM_TIMESTEP = b"ITEM: TIMESTEP"
+_ITEM_NUMBER_OF_ATOMS = b"ITEM: NUMBER OF ATOMS"
+_ITEM_ATOMS = b"ITEM: ATOMS"
+
+def _iter_byte_lines(path):
+    """
+    Iterate over the raw lines of a file through a read-only memory map.
+    
+    Args:
+        path (Path): Path to the file.
+        
+    Yields:
+        bytes: Each line without its trailing newline.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = 0
+            end = len(buf)
+            while pos < end:
+                newline = buf.find(b'\n', pos)
+                if newline == -1:
+                    newline = end
+                yield buf[pos:newline]
+                pos = newline + 1
+
+def _iter_lines(path):
+    """
+    Iterate over the lines of a file through a read-only memory map.
+    
+    Lines are decoded one at a time, so the file is never materialized as a
+    list of strings.
+    
+    Args:
+        path (Path): Path to the file.
+        
+    Yields:
+        str: Each line without its trailing newline.
+    """
+    for line in _iter_byte_lines(path):
+        yield line.decode()
+
+def _iter_velocity_blocks(path):
+    """
+    Split a LAMMPS dump into per-frame blocks at each ITEM: TIMESTEP header.
+    
+    Args:
+        path (Path): Path to the dump file.
+        
+    Yields:
+        bytes: The contents of each frame following its ITEM: TIMESTEP header.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = buf.find(_ITEM_TIMESTEP)
+            while pos != -1:
+                start = pos + len(_ITEM_TIMESTEP)
+                pos = buf.find(_ITEM_TIMESTEP, start)
+                yield buf[start:pos if pos != -1 else len(buf)]
+
+def _parse_velocity_block(block):
+    """
+    Parse the velocities of one LAMMPS dump frame.
+    
+    This is a pure function of its input so frames can be parsed in worker processes.
+    
+    Args:
+        block (bytes): The frame contents following its ITEM: TIMESTEP header.
+        
+    Returns:
+        numpy.ndarray: The (N, 3) velocity array indexed by atom ID, or an empty
+            placeholder if the frame has no atom section.
+    """
+    start = block.find(_ITEM_NUMBER_OF_ATOMS)
+    if start == -1:
+        return _MISSING_VELOCITY_FRAME
+    lines = block[start:].split(b'\n')
+    num_atoms = int(lines[1].strip())
+    
+    # Skip box bounds
+    header_index = next((i for i, line in enumerate(lines) if line.startswith(_ITEM_ATOMS)), None)
+    if header_index is None:
+        return _MISSING_VELOCITY_FRAME
+    
+    # Get column indices for id, vx, vy, vz
+    header = lines[header_index].split()
+    usecols = tuple(header.index(column) - 2 for column in (b"id", b"vx", b"vy", b"vz"))  # -2 for "ITEM: ATOMS"
+    
+    # Read num_atoms lines in one pass and scatter them by atom ID
+    data = np.loadtxt(
+        lines[header_index + 1:header_index + 1 + num_atoms],
+        usecols=usecols,
+        dtype=np.float64,
+        comments=None,
+        ndmin=2,
+    )
+    frame_velocities = np.zeros((num_atoms, 3))
+    frame_velocities[data[:, 0].astype(np.intp) - 1] = data[:, 1:4]  # Convert to 0-based index
+    return frame_velocities
+
+def _parse_velocity_blocks(blocks):
+    """
+    Parse a batch of LAMMPS dump frames in a worker process.
+    
+    Args:
+        blocks (list): Frame contents as yielded by _iter_velocity_blocks.
+        
+    Returns:
+        list: The velocity array of each frame, see _parse_velocity_block.
+    """
+    return [_parse_velocity_block(block) for block in blocks]
+
 class ASEService:
     """Service for analyzing molecular dynamics simulations using ASE."""
     
     def __init__(self):
         """Initialize the ASE service."""
         self.logger = logging.getLogger(__name__)
+        
+        # Worker processes for large velocity dumps, started on first use and kept for later analyses
+        self._velocity_workers = min(VELOCITY_PARALLEL_WORKERS, os.cpu_count() or 1)
+        self._velocity_pool = None
+        self._velocity_pool_lock = threading.Lock()
+    
+    @property
+    def velocity_pool(self):
+        """
+        The velocity parsing pool, created on first use.
+        
+        Workers are spawned rather than forked, since analyses run in threads.
+        
+        Returns:
+            concurrent.futures.ProcessPoolExecutor: The shared pool.
+        """
+        with self._velocity_pool_lock:
+            if self._velocity_pool is None:
+                self._velocity_pool = ProcessPoolExecutor(
+                    max_workers=self._velocity_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._velocity_pool
     
-    def analyze_trajectory(self, trajectory_path, velocity_path=None):
+    def close(self):
+        """Shut down the velocity parsing pool."""
+        with self._velocity_pool_lock:
+            if self._velocity_pool is not None:
+                self._velocity_pool.shutdown(wait=False, cancel_futures=True)
+                self._velocity_pool = None
+    
+    def analyze_trajectory(self, trajectory_path, velocity_path=None, msd_method="origin"):
         """
         Analyze a molecular dynamics trajectory.
         
         Args:
             trajectory_path (Path): Path to the trajectory file (xyz, lammps dump, etc.)
             velocity_path (Path, optional): Path to the velocity file (lammps dump with velocities)
+            msd_method (str, optional): "origin" for the MSD relative to the first frame,
+                "fft" for the time-averaged MSD as a function of lag time.
+            
+        Returns:
+            dict: A dictionary with the analysis results.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                return self._analyze_trajectory(trajectory_path, velocity_path, msd_method, pool)
+        except Exception as e:
+            self.logger.exception(f"Error analyzing trajectory: {str(e)}")
+            return {"error": f"Failed to analyze trajectory: {str(e)}"}
+    
+    def _analyze_trajectory(self, trajectory_path, velocity_path, msd_method, pool):
+        """
+        Analyze a trajectory while its velocity file is parsed concurrently.
+        
+        Args:
+            trajectory_path (Path): Path to the trajectory file.
+            velocity_path (Path): Path to the velocity file, or None.
+            msd_method (str): "origin" or "fft", see analyze_trajectory.
+            pool (concurrent.futures.Executor): Executor for the velocity file parse.
             
         Returns:
             dict: A dictionary with the analysis results.
         """
+        # Read velocity file if provided, overlapping with the trajectory read
+        velocities = None
+        if velocity_path and velocity_path.exists():
+            velocities = pool.submit(self._parse_velocity_file, velocity_path)
+        
+        # Check file extension (handling both .xyz and cases wheresuffix is not set properly)
+        if trajectory_path.suffix.lower() == '.xyz' or str(trajectory_path).endswith('.xyz'):
+            file_format, format_name = 'xyz', "standard XYZ format"
+        else:
+            file_format, format_name = 'lammps-dump', "LAMMPS dump format"
+        
+        # Stream the trajectory with ASE, falling back to manual parsing
+        result = None
         try:
-            # Try to read the trajectory with ASE
-            trajectory = None
+            frames = iread(str(trajectory_path), index=':', format=file_format)
+            result = self._analyze_frames(frames, velocities, msd_method)
+            if result:
+                self.logger.info(f"Successfully read {result['frames']} frames with {format_name}")
+        except Exception as e:
+            self.logger.warning(f"Failed to read with {format_name}: {str(e)}")
             
-            # Check file extension (handling both .xyz and cases wheresuffix is not set properly)
-            if trajectory_path.suffix.lower() == '.xyz' or str(trajectory_path).endswith('.xyz'):
-                try:
-                    trajectory = read(str(trajectory_path), index=':', format='xyz')
-                    self.logger.info(f"Successfully read {len(trajectory)} frames with standard XYZ format")
-                except Exception as e:
-                    self.logger.warning(f"Failed to read with standard XYZ format: {str(e)}")
-                    
-                    # Try manual parsing
-                    trajectory = self._parse_xyz_manually(trajectory_path)
-                    if trajectory:
-                        self.logger.info(f"Successfully read {len(trajectory)} frames with manual parsing")
+            # Try manual parsing; without velocities only the positions are needed
+            if velocities is None or velocities.result() is None:
+                positions, _ = self._parse_xyz_positions(trajectory_path)
+                result = self._analyze_positions(positions, msd_method) if positions is not None else None
             else:
-                # Try to read as LAMMPS dump file
-                try:
-                    trajectory = read(str(trajectory_path), index=':', format='lammps-dump')
-                    self.logger.info(f"Successfully read {len(trajectory)} frames with LAMMPS dump format")
-                except Exception as e:
-                    self.logger.warning(f"Failed to read with LAMMPS dump format: {str(e)}")
-                    
-                    # Try manual parsing if possible
-                    trajectory = self._parse_xyz_manually(trajectory_path)
-                    if trajectory:
-                        self.logger.info(f"Successfully read {len(trajectory)} frames with manual parsing")
+                result = self._analyze_frames(self._iter_xyz_frames(trajectory_path), velocities, msd_method)
+            if result:
+                self.logger.info(f"Successfully read {result['frames']} frames with manual parsing")
+        
+        if not result:
+            self.logger.error("Failed to read trajectory file")
+            return {"error": "Failed to parse trajectory file"}
+        
+        return result
+    
+    def _analyze_frames(self, frames, velocities=None, msd_method="origin"):
+        """
+        Compute MSD and kinetic energy in a single pass over a stream of frames.
+        
+        Frames are consumed in chunks of FRAME_CHUNK_SIZE, so memory stays bounded
+        regardless of trajectory length. Only the FFT MSD, which needs the full
+        position history, keeps the positions of every frame.
+        
+        Args:
+            frames (iterable): ASE Atoms objects, one per frame.
+            velocities (list or concurrent.futures.Future, optional): Per-frame velocity arrays
+                from a velocity dump, or a future resolving to them once the frames are read.
+            msd_method (str, optional): "origin" or "fft", see analyze_trajectory.
             
-            if not trajectory:
-                self.logger.error("Failed to read trajectory file")
-                return {"error": "Failed to parse trajectory file"}
+        Returns:
+            dict: The analysis results, with MSD and kinetic energy as NumPy arrays,
+                or None if no frames were read.
+        """
+        frames = iter(frames)
+        initial_positions = None
+        masses = numbers = None
+        msd_parts, kinetic_energy_parts, chunk_masses_parts = [], [], []
+        n_frames = 0
+        
+        for chunk in iter(lambda: list(islice(frames, FRAME_CHUNK_SIZE)), []):
+            positions = np.stack([atoms.get_positions() for atoms in chunk], axis=0)
             
-            # Read velocity file if provided
-            velocities = None
-            if velocity_path and velocity_path.exists():
-                try:
-                    velocities = self._parse_velocity_file(velocity_path)
-                    self.logger.info(f"Successfully read velocities for {len(velocities)} frames")
-                    
-                    # Add velocities to trajectory atoms objects
-                    if len(velocities) == len(trajectory):
-                        for i, (atoms, vels) in enumerate(zip(trajectory, velocities)):
-                            if len(vels) == len(atoms):
-                                atoms.set_velocities(vels)
-                                self.logger.info(f"Added velocities to frame {i}")
-                            else:
-                                self.logger.warning(f"Velocity frame {i} has {len(vels)} atoms but trajectory has {len(atoms)} atoms")
-                    else:
-                        self.logger.warning(f"Velocity file has {len(velocities)} frames but trajectory has {len(trajectory)} frames")
-                except Exception as e:
-                    self.logger.warning(f"Failed to read velocity file: {str(e)}")
+            # Composition is constant in MD, so masses are looked up once and reused
+            if numbers is None:
+                numbers = chunk[0].numbers.copy()
+                masses = chunk[0].get_masses()
+            if all(self._same_composition(atoms, numbers) for atoms in chunk):
+                chunk_masses = np.broadcast_to(masses, positions.shape[:2])
+            else:
+                chunk_masses = np.stack([atoms.get_masses() for atoms in chunk], axis=0)
+            own_velocities = np.stack([
+                atoms.get_velocities() if atoms.has('momenta') else np.full((len(atoms), 3), np.nan)
+                for atoms in chunk
+            ], axis=0)
+            stored_kinetic_energy = np.array([
+                atoms.info.get('kinetic_energy', np.nan) for atoms in chunk
+            ], dtype=np.float64)
             
             # Calculate mean square displacement
-            msd = self._calculate_msd(trajectory)
+            if initial_positions is None:
+                initial_positions = positions[0]
+            if msd_method == "fft":
+                msd_parts.append(positions)
+            else:
+                msd_parts.append(self._calculate_msd(positions, initial_positions))
             
             # Calculate kinetic energy
-            kinetic_energy = self._calculate_kinetic_energy(trajectory)
+            kinetic_energy = self._calculate_kinetic_energy(own_velocities, chunk_masses, stored_kinetic_energy)
+            kinetic_energy_parts.append(kinetic_energy)
+            chunk_masses_parts.append(chunk_masses)
             
-            # Return the results
-            return {
-                "msd": msd.tolist() if msd is not None else None,
-                "kinetic_energy": kinetic_energy.tolist() if kinetic_energy is not None else None,
-                "frames": len(trajectory),
-                "atoms": len(trajectory[0])
-            }
-        except Exception as e:
-            self.logger.exception(f"Error analyzing trajectory: {str(e)}")
-            return {"error": f"Failed to analyze trajectory: {str(e)}"}
+            n_frames += len(chunk)
+        
+        if n_frames == 0:
+            return None
+        
+        if msd_method == "fft":
+            msd = self._calculate_msd_fft(np.concatenate(msd_parts, axis=0))
+        else:
+            msd = np.concatenate(msd_parts)
+        
+        # The velocity dump may still be parsing in the background
+        if isinstance(velocities, Future):
+            velocities = velocities.result()
+            if velocities is not None:
+                self.logger.info(f"Successfully read velocities for {len(velocities)} frames")
+        
+        if velocities is not None and len(velocities) == n_frames:
+            # Velocities from the dump override the frame's own, when the atom counts agree
+            dump_kinetic_energy_parts = []
+            start = 0
+            for chunk_masses, own_kinetic_energy in zip(chunk_masses_parts, kinetic_energy_parts):
+                n_atoms = chunk_masses.shape[1]
+                dump_velocities = np.stack([
+                    vels if len(vels) == n_atoms else np.full((n_atoms, 3), np.nan)
+                    for vels in velocities[start:start + len(own_kinetic_energy)]
+                ], axis=0)
+                dump_kinetic_energy_parts.append(
+                    self._calculate_kinetic_energy(dump_velocities, chunk_masses, own_kinetic_energy)
+                )
+                start += len(own_kinetic_energy)
+            kinetic_energy = np.concatenate(dump_kinetic_energy_parts)
+        else:
+            if velocities is not None:
+                self.logger.warning(f"Velocity file has {len(velocities)} frames but trajectory has {n_frames} frames")
+            kinetic_energy = np.concatenate(kinetic_energy_parts)
+        
+        # Return the results
+        return {
+            "msd": msd,
+            "kinetic_energy": kinetic_energy,
+            "frames": n_frames,
+            "atoms": len(initial_positions)
+        }
+    
+    @staticmethod
+    def _same_composition(atoms, numbers) -> bool:
+        """
+        Check whether a frame has the given atomic numbers and no custom masses.
+        
+        Args:
+            atoms (Atoms): The frame.
+            numbers (numpy.ndarray): The reference atomic numbers.
+            
+        Returns:
+            bool: True if cached masses for the reference numbers apply to the frame.
+        """
+        return len(atoms) == len(numbers) and not atoms.has('masses') and np.array_equal(atoms.numbers, numbers)
+    
+    def _analyze_positions(self, positions: np.ndarray, msd_method="origin"):
+        """
+        Compute the MSD of a stacked trajectory that carries no velocity data.
+        
+        Args:
+            positions (numpy.ndarray): Positions with shape (frames, atoms, 3).
+            msd_method (str, optional): "origin" or "fft", see analyze_trajectory.
+            
+        Returns:
+            dict: The analysis results, with zero kinetic energy for every frame.
+        """
+        if msd_method == "fft":
+            msd = self._calculate_msd_fft(positions)
+        else:
+            msd = self._calculate_msd(positions)
+        
+        kinetic_energy = np.zeros(positions.shape[0])
+        self.logger.warning(f"Kinetic energy not available for {positions.shape[0]} frames. Setting as 0.0.")
+        
+        return {
+            "msd": msd,
+            "kinetic_energy": kinetic_energy,
+            "frames": positions.shape[0],
+            "atoms": positions.shape[1]
+        }
     
-    def _calculate_msd(self, trajectory: list) -> np.ndarray:
+    def _calculate_msd(self, positions: np.ndarray, initial_positions: np.ndarray = None) -> np.ndarray:
         """
         Calculate the mean square displacement (MSD) relative to the initial frame.
         
+        Displacements are reduced in float32, which is ample precision for
+        plotting and halves the memory traffic; the result is returned as float64.
+        
         Args:
-            trajectory (list): List of ASE Atoms objects.
+            positions (numpy.ndarray): Positions with shape (frames, atoms, 3).
+            initial_positions (numpy.ndarray, optional): Reference positions; defaults to the first frame.
             
         Returns:
             numpy.ndarray: Mean square displacement values.
         """
         try:
-            initial_positions = trajectory[0].get_positions()
-            msd = np.zeros(len(trajectory))
-            for i, atoms in enumerate(trajectory):
-                positions = atoms.get_positions()
-                displacement = positions - initial_positions
-                # 各原子ごとの変位の2乗を計算して平均値を算出
-                square_displacement = np.sum(displacement**2, axis=1)
-                msd[i] = np.mean(square_displacement)
+            # 変位はfloat64で計算してからfloat32で保持する（絶対座標の桁落ちを避けるため）
+            if initial_positions is None:
+                initial_positions = positions[0]
+            displacement = np.subtract(positions, initial_positions, out=np.empty(positions.shape, dtype=np.float32))
+            # 全フレームの各原子の変位の2乗和を一度に計算し、原子数で割って平均値を算出
+            msd = np.einsum('fnd,fnd->f', displacement, displacement).astype(np.float64) / positions.shape[1]
             return msd
         except Exception as e:
             self.logger.exception(f"Error calculating MSD: {str(e)}")
             return None
     
-    def _calculate_kinetic_energy(self, trajectory: list) -> np.ndarray:
+    def _calculate_msd_fft(self, positions: np.ndarray) -> np.ndarray:
         """
-        Calculate the kinetic energy from the trajectory.
+        Calculate the time-averaged MSD over lag times with the FFT algorithm.
+        
+        Every frame is used as a time origin, so the result is much less noisy
+        than the MSD relative to the initial frame, at O(F log F) cost per atom
+        (Kneller & Hinsen).
         
         Args:
-            trajectory (list): List of ASE Atoms objects.
+            positions (numpy.ndarray): Positions with shape (frames, atoms, 3).
             
         Returns:
-            numpy.ndarray: Kinetic energy for each frame.
+            numpy.ndarray: Mean square displacement for each lag time.
         """
         try:
-            kinetic_energy = np.zeros(len(trajectory))
-            for i, atoms in enumerate(trajectory):
-                energy = None
-                try:
-                    velocities = atoms.get_velocities()
-                    if velocities is not None:
-                        masses = atoms.get_masses()
-                        # より明示的に計算: 各原子の速度の二乗の和を質量と掛け、全体を合計
-                        velocity_squared = np.sum(velocities**2, axis=1)
-                        energy = 0.5 * np.sum(masses * velocity_squared)
-                except Exception as e:
-                    self.logger.warning(f"Kinetic energy calculation failed for frame {i}: {str(e)}")
-                
-                if energy is None:
-                    if 'kinetic_energy' in atoms.info:
-                        energy = atoms.info['kinetic_energy']
-                    else:
-                        self.logger.warning(f"Kinetic energy not available for frame {i}. Setting as NaN.")
-                        energy = np.nan
-                        
-                kinetic_energy[i] = energy
+            n_frames = positions.shape[0]
+            lags = n_frames - np.arange(n_frames)
+            
+            # S2: 位置の自己相関をFFTで計算（ゼロ埋めで循環相関を回避）
+            spectrum = np.fft.rfft(positions, n=2 * n_frames, axis=0)
+            autocorr = np.fft.irfft(spectrum * spectrum.conj(), axis=0)[:n_frames]
+            s2 = autocorr.sum(axis=-1) / lags[:, None]
+            
+            # S1: 再帰式 Q_m = Q_{m-1} - D_{m-1} - D_{F-m} をcumsumで一括計算
+            sq = np.einsum('fnd,fnd->fn', positions, positions)
+            removed = np.zeros_like(sq)
+            removed[1:] = sq[:-1] + sq[:0:-1]
+            s1 = (2 * sq.sum(axis=0) - np.cumsum(removed, axis=0)) / lags[:, None]
+            
+            return (s1 - 2 * s2).mean(axis=1)
+        except Exception as e:
+            self.logger.exception(f"Error calculating MSD with FFT: {str(e)}")
+            return None
+    
+    def _calculate_kinetic_energy(self, velocities: np.ndarray, masses: np.ndarray,
+                                  stored_kinetic_energy: np.ndarray = None) -> np.ndarray:
+        """
+        Calculate the kinetic energy of each frame.
+        
+        The reduction runs in float32 like the MSD; the result is returned as float64.
+        
+        Args:
+            velocities (numpy.ndarray): Velocities with shape (frames, atoms, 3); NaN for frames without velocities.
+            masses (numpy.ndarray): Atomic masses with shape (frames, atoms).
+            stored_kinetic_energy (numpy.ndarray, optional): Kinetic energy stored in each frame, NaN if absent.
+            
+        Returns:
+            numpy.ndarray: Kinetic energy for each frame, 0.0 where it is not available.
+        """
+        try:
+            # 全フレームについて質量で重み付けした速度の二乗和を一度に計算
+            velocities = np.asarray(velocities, dtype=np.float32)
+            masses = np.asarray(masses, dtype=np.float32)
+            kinetic_energy = 0.5 * np.einsum('fnd,fnd,fn->f', velocities, velocities, masses).astype(np.float64)
+            
+            # Frames without velocities fall back to the stored kinetic energy, or 0.0
+            missing = np.isnan(kinetic_energy)
+            if stored_kinetic_energy is not None:
+                kinetic_energy[missing] = stored_kinetic_energy[missing]
+                missing = np.isnan(kinetic_energy)
+            if missing.any():
+                self.logger.warning(f"Kinetic energy not available for {np.count_nonzero(missing)} frames. Setting as 0.0.")
+                kinetic_energy[missing] = 0.0
             return kinetic_energy
         except Exception as e:
             self.logger.exception(f"Error calculating kinetic energy: {str(e)}")
@@ -166,73 +504,7 @@ class ASEService:
             list: List of ASE Atoms objects or None if parsing fails.
         """
         try:
-            with open(trajectory_path, 'r') as f:
-                lines = f.readlines()
-            
-            trajectory = []
-            total_lines = len(lines)
-            i = 0
-            while i < total_lines:
-                # skip any leading empty lines
-                while i < total_lines and not lines[i].strip():
-                    i += 1
-                if i >= total_lines:
-                    break
-                
-                # Parse number of atoms
-                try:
-                    n_atoms = int(lines[i].strip())
-                    self.logger.debug(f"Found frame with {n_atoms} atoms at line {i}")
-                except ValueError:
-                    self.logger.debug(f"Skipping non-numeric line at index {i}: {lines[i].strip()}")
-                    i += 1
-                    continue
-                i += 1  # Move past the atoms count line
-                
-                # Skip comment line (XYZフォーマットでは2行目がコメント)
-                if i < total_lines:
-                    i += 1
-                    
-                # Skip any blank lines followingコメント
-                while i < total_lines and not lines[i].strip():
-                    i += 1
-                
-                positions = []
-                symbols = []
-                for j in range(n_atoms):
-                    if i + j >= total_lines:
-                        self.logger.warning("Unexpected end of file while reading atom data")
-                        break
-                    line = lines[i + j].strip()
-                    if not line:
-                        continue
-                    parts = line.split()
-                    if len(parts) < 4:
-                        self.logger.debug(f"Skipped line due to insufficient data: {line}")
-                        continue
-                    symbol = parts[0]
-                    try:
-                        # 原子種が数字の場合、対応する記号に変換
-                        atom_type = int(symbol)
-                        symbol = self._get_symbol_from_type(atom_type)
-                    except ValueError:
-                        # 数字でなければそのまま利用
-                        pass
-                    try:
-                        x, y, z = float(parts[1]), float(parts[2]), float(parts[3])
-                    except ValueError:
-                        self.logger.debug(f"Invalid coordinate values in line: {line}")
-                        continue
-                    symbols.append(symbol)
-                    positions.append([x, y, z])
-                i += n_atoms  # Move index past原子情報行
-                
-                if len(positions) == n_atoms and len(symbols) == n_atoms:
-                    atoms = Atoms(symbols=symbols, positions=positions)
-                    trajectory.append(atoms)
-                    self.logger.debug(f"Added frame with {n_atoms} atoms")
-                else:
-                    self.logger.warning("Frame skipped due to missing or invalid atom data")
+            trajectory = list(self._iter_xyz_frames(trajectory_path))
             if not trajectory:
                 self.logger.warning("No frames were parsed from the trajectory file")
                 return None
@@ -241,39 +513,145 @@ class ASEService:
             self.logger.exception(f"Error parsing XYZ manually: {str(e)}")
             return None
     
-    def _get_symbol_from_type(self, atom_type: int) -> str:
+    def _parse_xyz_positions(self, trajectory_path: Path) -> tuple:
         """
-        Get the element symbol from the atom type.
+        Parse the positions of an XYZ file without building ASE Atoms objects.
         
         Args:
-            atom_type (int): Atom type.
+            trajectory_path (Path): Path to the XYZ file.
             
         Returns:
-            str: Element symbol.
-        """
-        type_to_symbol = {
-            1: 'Ar',  # 例: 一般的なLJシミュレーションでは1をArgonとする
-            2: 'He',
-            3: 'Li',
-            4: 'Be',
-            5: 'B',
-            6: 'C',
-            7: 'N',
-            8: 'O',
-            9: 'F',
-            10: 'Ne',
-            11: 'Na',
-            12: 'Mg',
-            13: 'Al',
-            14: 'Si',
-            15: 'P',
-            16: 'S',
-            17: 'Cl',
-            18: 'Ar',
-            19: 'K',
-            20: 'Ca',
-        }
-        return type_to_symbol.get(atom_type, 'X')
+            tuple: (positions, symbols) where positions has shape (frames, atoms, 3) and
+                symbols are those of the first frame, or (None, None) if parsing fails.
+        """
+        try:
+            symbols = None
+            positions = []
+            for frame_symbols, frame_positions in self._iter_xyz_blocks(trajectory_path):
+                if symbols is None:
+                    symbols = frame_symbols
+                positions.append(frame_positions)
+            if not positions:
+                self.logger.warning("No frames were parsed from the trajectory file")
+                return None, None
+            return np.stack(positions, axis=0), symbols
+        except Exception as e:
+            self.logger.exception(f"Error parsing XYZ positions: {str(e)}")
+            return None, None
+    
+    def _iter_xyz_frames(self, trajectory_path: Path):
+        """
+        Stream the frames of an XYZ file one at a time.
+        
+        Args:
+            trajectory_path (Path): Path to the XYZ file.
+            
+        Yields:
+            Atoms: Each successfully parsed frame.
+        """
+        for symbols, positions in self._iter_xyz_blocks(trajectory_path):
+            yield Atoms(symbols=symbols, positions=positions)
+    
+    def _iter_xyz_blocks(self, trajectory_path: Path):
+        """
+        Stream the symbols and positions of each XYZ frame.
+        
+        Args:
+            trajectory_path (Path): Path to the XYZ file.
+            
+        Yields:
+            tuple: (symbols, positions) of each successfully parsed frame.
+        """
+        # Check the log level once rather than formatting messages for every frame
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        lines = _iter_lines(trajectory_path)
+        for line in lines:
+            # skip any leading empty lines
+            if not line.strip():
+                continue
+            
+            # Parse number of atoms
+            try:
+                n_atoms = int(line.strip())
+                if debug:
+                    self.logger.debug("Found frame with %d atoms", n_atoms)
+            except ValueError:
+                if debug:
+                    self.logger.debug("Skipping non-numeric line: %s", line.strip())
+                continue
+            
+            # Skip comment line (XYZフォーマットでは2行目がコメント)
+            next(lines, None)
+            
+            # Collect the atom lines, skipping any blank lines followingコメント
+            block = []
+            if n_atoms > 0:
+                for line in lines:
+                    if block or line.strip():
+                        block.append(line)
+                        if len(block) == n_atoms:
+                            break
+            if len(block) < n_atoms:
+                self.logger.warning("Unexpected end of file while reading atom data")
+            symbols, positions = self._parse_xyz_block(block)
+            
+            if len(positions) == n_atoms and len(symbols) == n_atoms:
+                if debug:
+                    self.logger.debug("Added frame with %d atoms", n_atoms)
+                yield symbols, positions
+            else:
+                self.logger.warning("Frame skipped due to missing or invalid atom data")
+    
+    def _parse_xyz_block(self, block: list) -> tuple:
+        """
+        Parse the atom lines of a single XYZ frame.
+        
+        Well-formed frames are converted in a single NumPy call; frames with
+        malformed lines fall back to line-by-line parsing that skips bad lines.
+        
+        Args:
+            block (list): The atom lines of the frame.
+            
+        Returns:
+            tuple: (symbols, positions) where positions is an (N, 3) array.
+        """
+        try:
+            # Fast path: convert all coordinates of the frame at once in C
+            positions = np.loadtxt(block, usecols=(1, 2, 3), dtype=np.float64, comments=None, ndmin=2)
+            symbols = [line.split(None, 1)[0] for line in block if line.strip()]
+        except (ValueError, IndexError):
+            positions = np.empty((len(block), 3), dtype=np.float64)
+            symbols = [''] * len(block)
+            valid = 0
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            for line in block:
+                line = line.strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) < 4:
+                    if debug:
+                        self.logger.debug("Skipped line due to insufficient data: %s", line)
+                    continue
+                try:
+                    x, y, z = float(parts[1]), float(parts[2]), float(parts[3])
+                except ValueError:
+                    if debug:
+                        self.logger.debug("Invalid coordinate values in line: %s", line)
+                    continue
+                symbols[valid] = parts[0]
+                positions[valid] = (x, y, z)
+                valid += 1
+            symbols = symbols[:valid]
+            positions = positions[:valid]
+        
+        # 原子種が数字の場合、対応する記号に変換
+        n_types = len(_TYPE_TO_SYMBOL)
+        symbols = [
+            (_TYPE_TO_SYMBOL[int(symbol)] if int(symbol) < n_types else 'X') if symbol.isdigit() else symbol
+            for symbol in symbols
+        ]
+        return symbols, positions
     
     def _parse_velocity_file(self, velocity_path):
         """
@@ -286,62 +664,36 @@ class ASEService:
             list: List of velocity arrays for each frame.
         """
         try:
-            with open(velocity_path, 'r') as f:
-                lines = f.readlines()
-            
-            velocities = []
-            i = 0
-            while i < len(lines):
-                # Look for ITEM: TIMESTEP
-                if i < len(lines) and "ITEM: TIMESTEP" in lines[i]:
-                    i += 2  # Skip timestep line
-                    
-                    # Look for ITEM: NUMBER OF ATOMS
-                    if i < len(lines) and "ITEM: NUMBER OF ATOMS" in lines[i]:
-                        i += 1
-                        num_atoms = int(lines[i].strip())
-                        i += 1
-                        
-                        # Skip box bounds
-                        while i < len(lines) and "ITEM: ATOMS" not in lines[i]:
-                            i += 1
-                        
-                        # Parse atom velocities
-                        if i < len(lines) and "ITEM: ATOMS" in lines[i]:
-                            # Get column indices for id, vx, vy, vz
-                            header = lines[i].strip().split()
-                            id_idx = header.index("id") - 2  # -2 because "ITEM: ATOMS" counts as 2 words
-                            vx_idx = header.index("vx") - 2
-                            vy_idx = header.index("vy") - 2
-                            vz_idx = header.index("vz") - 2
-                            
-                            i += 1
-                            frame_velocities = np.zeros((num_atoms, 3))
-                            atom_ids = []
-                            
-                            # Read num_atoms lines
-                            for j in range(num_atoms):
-                                if i + j < len(lines):
-                                    parts = lines[i + j].strip().split()
-                                    atom_id = int(parts[id_idx]) - 1  # Convert to 0-based index
-                                    vx = float(parts[vx_idx])
-                                    vy = float(parts[vy_idx])
-                                    vz = float(parts[vz_idx])
-                                    
-                                    atom_ids.append(atom_id)
-                                    frame_velocities[atom_id] = [vx, vy, vz]
-                            
-                            velocities.append(frame_velocities)
-                            i += num_atoms
-                        else:
-                            i += 1
-                    else:
-                        i += 1
-                else:
-                    i += 1
-            
+            velocities = list(self._iter_velocity_frames(velocity_path))
             self.logger.info(f"Parsed {len(velocities)} velocity frames")
             return velocities
         except Exception as e:
             self.logger.exception(f"Error parsing velocity file: {str(e)}")
             return None
+    
+    def _iter_velocity_frames(self, velocity_path):
+        """
+        Stream the frames of a LAMMPS velocity dump file one at a time.
+        
+        Args:
+            velocity_path (Path): Path to the velocity dump file.
+            
+        Yields:
+            numpy.ndarray: The (N, 3) velocity array of each frame, indexed by atom ID, or an
+                empty placeholder for a frame that could not be parsed.
+        """
+        blocks = _iter_velocity_blocks(velocity_path)
+        if os.path.getsize(velocity_path) >= VELOCITY_PARALLEL_MIN_SIZE:
+            # Large dumps: parse batches of frames in the worker processes, with a bounded
+            # number of batches in flight so the dump is never held in memory at once
+            pool = self.velocity_pool
+            pending = deque()
+            for batch in iter(lambda: list(islice(blocks, VELOCITY_BATCH_SIZE)), []):
+                pending.append(pool.submit(_parse_velocity_blocks, batch))
+                if len(pending) >= 2 * self._velocity_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        else:
+            for block in blocks:
+                yield _parse_velocity_block(block)
@@ -1,15 +1,20 @@
 import os
+import gzip
 import logging
-import json
 import uuid
 from typing import Dict, Any, Optional
 import httpx
+import orjson
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 HASURA_URL = os.environ.get("HASURA_URL", "http://hasura:8080/v1/graphql")
 HASURA_ADMIN_SECRET = os.environ.get("HASURA_ADMIN_SECRET", "myadminsecretkey")
+# Gzip request bodies larger than GZIP_MIN_SIZE bytes. Only enable this when Hasura is
+# reached through a proxy that decodes Content-Encoding: gzip request bodies.
+HASURA_GZIP_REQUESTS = os.environ.get("HASURA_GZIP_REQUESTS", "false").lower() == "true"
+GZIP_MIN_SIZE = 4096
 
 class DBService:
     """Service for database operations via Hasura GraphQL."""
@@ -20,8 +25,32 @@ class DBService:
             "Content-Type": "application/json",
             "X-Hasura-Admin-Secret": HASURA_ADMIN_SECRET
         }
+        self._client: Optional[httpx.AsyncClient] = None
     
-    async def save_potential_file(self, filename: str, content: str, file_path: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        The pooled HTTP client, created on first use so connections to Hasura are reused.
+        
+        Returns:
+            httpx.AsyncClient: The shared client.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                timeout=30.0
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def save_potential_file(self, filename: str, content: str, file_path: str,
+                                  user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Save a potential file to the database.
         
@@ -130,6 +159,57 @@ class DBService:
         
         return await self._execute_query(query, variables)
     
+    async def create_simulation_with_input(self, content: str, name: Optional[str] = None,
+                                           potential_file_id: Optional[str] = None,
+                                           user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Save a simulation input and create its simulation record in a single request.
+        
+        The input is inserted through the simulation's input relationship, so Hasura
+        creates both rows in one transaction.
+        
+        Args:
+            content (str): The content of the input file.
+            name (str, optional): The name of the input.
+            potential_file_id (str, optional): The ID of the associated potential file.
+            user_id (str, optional): The ID of the user who created the simulation.
+            
+        Returns:
+            Dict[str, Any]: The created simulation record, including the input ID.
+        """
+        query = """
+        mutation CreateSimulationWithInput($content: String!, $name: String, $potential_file_id: uuid, $user_id: uuid) {
+            insert_simulations_one(object: {
+                status: "pending",
+                user_id: $user_id,
+                input: {
+                    data: {
+                        content: $content,
+                        name: $name,
+                        potential_file_id: $potential_file_id,
+                        user_id: $user_id
+                    }
+                }
+            }) {
+                id
+                status
+                created_at
+                input {
+                    id
+                }
+            }
+        }
+        """
+        
+        variables = {
+            "content": content,
+            "name": name,
+            "potential_file_id": potential_file_id,
+            "user_id": user_id
+        }
+        
+        return await self._execute_query(query, variables)
+    
     async def update_simulation_results(self, simulation_id: str, results: Dict[str, Any]) -> Dict[str, Any]:
         """
         Update a simulation with its results.
@@ -179,8 +259,8 @@ class DBService:
             "status": "completed" if not results.get("error") else "failed",
             "trajectory_file_path": results.get("trajectory_file_path"),
             "velocity_file_path": results.get("velocity_file_path"),
-            "msd": json.dumps(results.get("msd")) if results.get("msd") else None,
-            "kinetic_energy": json.dumps(results.get("kinetic_energy")) if results.get("kinetic_energy") else None,
+            "msd": self._dumps_series(results.get("msd")),
+            "kinetic_energy": self._dumps_series(results.get("kinetic_energy")),
             "frames": results.get("frames"),
             "atoms": results.get("atoms"),
             "error": results.get("error")
@@ -188,6 +268,23 @@ class DBService:
         
         return await self._execute_query(query, variables)
     
+    @staticmethod
+    def _dumps_series(values) -> Optional[str]:
+        """
+        Serialize a per-frame series to a JSON string.
+        
+        NumPy arrays are encoded directly without a list copy; NaN values become null.
+        
+        Args:
+            values (list or numpy.ndarray): The series, or None.
+            
+        Returns:
+            str: The JSON string, or None if the series is missing or empty.
+        """
+        if values is None or len(values) == 0:
+            return None
+        return orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    
     async def get_simulation(self, simulation_id: str) -> Dict[str, Any]:
         """
         Get a simulation by ID.
@@ -242,27 +339,30 @@ class DBService:
         Returns:
             Dict[str, Any]: The query result.
         """
+        payload = orjson.dumps({
+            "query": query,
+            "variables": variables
+        }, option=orjson.OPT_SERIALIZE_NUMPY)
+        
+        headers = None
+        if HASURA_GZIP_REQUESTS and len(payload) > GZIP_MIN_SIZE:
+            # Float arrays compress well, so large result updates shrink several times over
+            payload = gzip.compress(payload, compresslevel=5)
+            headers = {"Content-Encoding": "gzip"}
+        
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    HASURA_URL,
-                    headers=self.headers,
-                    json={
-                        "query": query,
-                        "variables": variables
-                    }
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                if "errors" in result:
-                    logger.error(f"GraphQL error: {result['errors']}")
-                    raise Exception(f"GraphQL error: {result['errors']}")
-                
-                # Extract the data from the first key in the data object
-                data_key = next(iter(result["data"]))
-                return result["data"][data_key]
+            response = await self.client.post(HASURA_URL, content=payload, headers=headers)
+            
+            response.raise_for_status()
+            result = orjson.loads(response.content)
+            
+            if "errors" in result:
+                logger.error(f"GraphQL error: {result['errors']}")
+                raise Exception(f"GraphQL error: {result['errors']}")
+            
+            # Extract the data from the first key in the data object
+            data_key = next(iter(result["data"]))
+            return result["data"][data_key]
         except Exception as e:
             logger.exception(f"Error executing GraphQL query: {str(e)}")
             raise 
\ No newline at end of file
@@ -1,4 +1,7 @@
 import os
+import asyncio
+import concurrent.futures
+import queue
 import subprocess
 import logging
 from pathlib import Path
@@ -8,13 +11,60 @@ import time
 import json
 import re
 
+from app.services.ase_service import ASEService
+
+# Patterns used to inspect LAMMPS input scripts
+_RE_MASS = re.compile(r'mass\s+\d+\s+\d+\.?\d*')
+_RE_XYZ_DUMP = re.compile(r'dump\s+\d+\s+all\s+xyz\s+\d+\s+(\S+)')
+_RE_VEL_DUMP = re.compile(r'dump\s+\d+\s+all\s+custom\s+\d+\s+(\S+).*v[xyz]')
+_RE_CREATE_BOX = re.compile(r'create_box\s+(\d+)')
+_RE_CREATE_ATOMS = re.compile(r'create_atoms')
+_RE_RUN = re.compile(r'\brun\b')
+_RE_FILE_COMMAND = re.compile(r'(read_data|read_restart|include|read_dump)\s+(\S+)')
+_RE_REQUIRED = re.compile(r'\b(?:(?P<units>units)|(?P<atom_style>atom_style)|(?P<run>run)|(?P<dump>dump))\b')
+_REQUIRED_COMMANDS = ('units', 'atom_style', 'run')
+
+# LAMMPS output is streamed to files in the run directory
+LOG_BUFFER_SIZE = 1 << 20
+STDERR_TAIL_SIZE = 64 * 1024
+
+# Cores given to each concurrent simulation when sizing the default pool
+THREADS_PER_SIMULATION = 4
+
 class LAMMPSService:
     """Service for running LAMMPS simulations."""
     
-    def __init__(self):
-        """Initialize the LAMMPS service."""
+    def __init__(self, max_workers=None, runner=None, scratch_dir=None):
+        """
+        Initialize the LAMMPS service.
+        
+        Args:
+            max_workers (int, optional): How many simulations may run at once. Defaults to one
+                per THREADS_PER_SIMULATION available cores.
+            runner (callable, optional): Runs a LAMMPS command as ``runner(cmd, cwd, stdout, stderr)``
+                and returns its exit code. Defaults to a local subprocess.
+            scratch_dir (Path, optional): Where LAMMPS runs, e.g. a tmpfs mount. Outputs that are
+                kept are moved to the simulations directory. Defaults to the simulations directory.
+        """
         self.logger = logging.getLogger(__name__)
         
+        # Bounded pool for concurrent simulations, each pinned to its own slice of the cores
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        max_workers = max_workers or max(1, (len(cpus) or os.cpu_count() or 1) // THREADS_PER_SIMULATION)
+        self._max_workers = max_workers
+        self._sim_pool = None
+        self._cpu_slots = queue.Queue()
+        per_worker = len(cpus) // max_workers
+        for i in range(max_workers):
+            self._cpu_slots.put(cpus[i * per_worker:(i + 1) * per_worker] if per_worker else None)
+        self._taskset = shutil.which("taskset")
+        
+        # Trajectory analysis service, created on the first completed run
+        self._ase = None
+        
+        # How LAMMPS commands are executed (e.g. inside a long-lived container in tests)
+        self._runner = runner or self._run_subprocess
+        
         # Check if we're running in a Docker container
         self.in_docker = os.environ.get('LAMMPS_SERVICE') == 'docker'
         
@@ -30,6 +80,10 @@ class LAMMPSService:
         # Create simulations directory if it doesn't exist
         if not self.simulations_dir.exists():
             self.simulations_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Run directories live in the scratch directory
+        self.scratch_dir = Path(scratch_dir) if scratch_dir else self.simulations_dir
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
             
         self.logger.info(f"LAMMPS service initialized with executable: {self.lammps_exec}")
         self.logger.info(f"Running in Docker: {self.in_docker}")
@@ -70,36 +124,40 @@ class LAMMPSService:
         velocity_filename = None
         
         # Extract XYZ dump filename
-        xyz_match = re.search(r'dump\s+\d+\s+all\s+xyz\s+\d+\s+(\S+)', input_content)
+        xyz_match = _RE_XYZ_DUMP.search(input_content)
         if xyz_match:
             xyz_filename = xyz_match.group(1)
             self.logger.info(f"Found XYZ dump filename: {xyz_filename}")
         
         # Extract velocity dump filename
-        vel_match = re.search(r'dump\s+\d+\s+all\s+custom\s+\d+\s+(\S+).*v[xyz]', input_content)
+        vel_match = _RE_VEL_DUMP.search(input_content)
         if vel_match:
             velocity_filename = vel_match.group(1)
             self.logger.info(f"Found velocity dump filename: {velocity_filename}")
         
         return xyz_filename, velocity_filename
     
-    def ensure_masses_set(self, input_content):
+    def ensure_masses_set(self, input_content, masses_present=None):
         """
         Ensure that all atom types have masses set in the input file.
         If masses are not set, add default mass settings.
         
         Args:
             input_content (str): The content of the LAMMPS input file.
+            masses_present (bool, optional): Whether masses are already set, if already known
+                from validation. Checked here when not given.
             
         Returns:
             str: The modified input content with mass settings.
         """
         # Check if masses are already set
-        if re.search(r'mass\s+\d+\s+\d+\.?\d*', input_content):
+        if masses_present is None:
+            masses_present = _RE_MASS.search(input_content) is not None
+        if masses_present:
             return input_content
         
         # Extract atom types from create_box command
-        create_box_match = re.search(r'create_box\s+(\d+)', input_content)
+        create_box_match = _RE_CREATE_BOX.search(input_content)
         if not create_box_match:
             self.logger.warning("Could not find create_box command to determine atom types")
             return input_content
@@ -107,51 +165,35 @@ class LAMMPSService:
         num_types = int(create_box_match.group(1))
         self.logger.info(f"Found {num_types} atom types in create_box command")
         
-        # Find a good place to insert mass commands (after create_atoms)
-        lines = input_content.split('\n')
-        modified_lines = []
-        mass_added = False
-        
-        for i, line in enumerate(lines):
-            modified_lines.append(line)
-            
-            # Add mass commands after create_atoms
-            if not mass_added and re.search(r'create_atoms', line):
-                # Add an empty line for readability
-                modified_lines.append("")
-                
-                # Add mass commands for each atom type
-                for atom_type in range(1, num_types + 1):
-                    modified_lines.append(f"mass {atom_type} 1.0  # Default mass added automatically")
-                
-                # Add another empty line
-                modified_lines.append("")
-                mass_added = True
-        
-        # If we couldn't find create_atoms, add mass commands before the first run command
-        if not mass_added:
-            for i, line in enumerate(lines):
-                if re.search(r'run', line):
-                    # Insert mass commands before run
-                    mass_lines = []
-                    mass_lines.append("")
-                    for atom_type in range(1, num_types + 1):
-                        mass_lines.append(f"mass {atom_type} 1.0  # Default mass added automatically")
-                    mass_lines.append("")
-                    
-                    # Combine the lines
-                    modified_lines = lines[:i] + mass_lines + lines[i:]
-                    mass_added = True
-                    break
+        mass_lines = '\n'.join(
+            f"mass {atom_type} 1.0  # Default mass added automatically"
+            for atom_type in range(1, num_types + 1)
+        )
         
-        # If we still couldn't add mass commands, add them at the end
-        if not mass_added:
-            modified_lines.append("")
-            for atom_type in range(1, num_types + 1):
-                modified_lines.append(f"mass {atom_type} 1.0  # Default mass added automatically")
+        # Find a good place to insert mass commands (after create_atoms)
+        idx = input_content.find('create_atoms')
+        if idx >= 0:
+            line_end = input_content.find('\n', idx)
+            if line_end == -1:
+                line_end = len(input_content)
+            # Surround the mass commands with empty lines for readability
+            modified_content = ''.join([
+                input_content[:line_end], '\n\n', mass_lines, '\n', input_content[line_end:]
+            ])
+        else:
+            # If we couldn't find create_atoms, add mass commands before the first run command
+            run_match = _RE_RUN.search(input_content)
+            if run_match:
+                line_start = input_content.rfind('\n', 0, run_match.start()) + 1
+                modified_content = ''.join([
+                    input_content[:line_start], '\n', mass_lines, '\n\n', input_content[line_start:]
+                ])
+            else:
+                # If we still couldn't add mass commands, add them at the end
+                modified_content = ''.join([input_content, '\n\n', mass_lines])
         
         self.logger.info("Added default mass settings to input file")
-        return '\n'.join(modified_lines)
+        return modified_content
     
     def validate_input_file(self, input_content):
         """
@@ -163,42 +205,103 @@ class LAMMPSService:
         Returns:
             tuple: (is_valid, message) where is_valid is a boolean and message is a string.
         """
+        is_valid, message, _ = self._validate_input(input_content)
+        return is_valid, message
+    
+    def _validate_input(self, input_content):
+        """
+        Validate a LAMMPS input file content, keeping what the checks found.
+        
+        Args:
+            input_content (str): The content of the LAMMPS input file.
+            
+        Returns:
+            tuple: (is_valid, message, info) where info holds ``masses_present`` for valid input.
+        """
         # Check for empty content
         if not input_content or not input_content.strip():
-            return False, "Input file is empty"
+            return False, "Input file is empty", {}
         
-        # Check for required commands
-        required_commands = ['units', 'atom_style', 'run']
-        missing_commands = [cmd for cmd in required_commands if cmd not in input_content]
+        # Check for required commands and the dump command in one scan
+        seen = {match.lastgroup for match in _RE_REQUIRED.finditer(input_content)}
+        missing_commands = [cmd for cmd in _REQUIRED_COMMANDS if cmd not in seen]
         if missing_commands:
-            return False, f"Missing required commands: {', '.join(missing_commands)}"
+            return False, f"Missing required commands: {', '.join(missing_commands)}", {}
         
         # Check for dump command
-        if 'dump' not in input_content:
-            return False, "Missing dump command for trajectory output"
-        
-        # Check for file references that might not exist
-        file_commands = ['read_data', 'read_restart', 'include', 'read_dump']
-        for cmd in file_commands:
-            if cmd in input_content:
-                # Extract the filename
-                pattern = rf"{cmd}\s+(\S+)"
-                matches = re.findall(pattern, input_content)
-                if matches:
-                    self.logger.warning(f"Input file references external file: {matches[0]} with command {cmd}")
+        if 'dump' not in seen:
+            return False, "Missing dump command for trajectory output", {}
+        
+        # Check for file references that might not exist (first reference per command)
+        referenced = {}
+        for cmd, filename in _RE_FILE_COMMAND.findall(input_content):
+            referenced.setdefault(cmd, filename)
+        for cmd, filename in referenced.items():
+            self.logger.warning(f"Input file references external file: {filename} with command {cmd}")
         
         # Check if masses are set
-        if not re.search(r'mass\s+\d+\s+\d+\.?\d*', input_content):
+        masses_present = _RE_MASS.search(input_content) is not None
+        if not masses_present:
             self.logger.warning("No mass settings found in input file. Will add default masses.")
         
-        return True, "Input file is valid"
+        return True, "Input file is valid", {"masses_present": masses_present}
+    
+    @property
+    def sim_pool(self):
+        """
+        The bounded simulation pool, created on first use.
+        
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: The shared pool.
+        """
+        if self._sim_pool is None:
+            self._sim_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        return self._sim_pool
+    
+    async def run_simulation_async(self, input_file_path):
+        """
+        Run a LAMMPS simulation on the service's bounded simulation pool.
+        
+        Args:
+            input_file_path (Path): The path to the LAMMPS input file.
+            
+        Returns:
+            dict: A dictionary with the simulation results.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.sim_pool, self._run_pooled_simulation, input_file_path)
+    
+    def _run_pooled_simulation(self, input_file_path):
+        """
+        Run a simulation on a pool worker, holding one CPU slot for its duration.
+        
+        Args:
+            input_file_path (Path): The path to the LAMMPS input file.
+            
+        Returns:
+            dict: A dictionary with the simulation results.
+        """
+        cpus = self._cpu_slots.get()
+        try:
+            return self.run_simulation(input_file_path, cpus=cpus)
+        finally:
+            self._cpu_slots.put(cpus)
+    
+    def close(self):
+        """Shut down the simulation pool without waiting for running simulations, and the analysis workers."""
+        if self._sim_pool is not None:
+            self._sim_pool.shutdown(wait=False)
+            self._sim_pool = None
+        if self._ase is not None:
+            self._ase.close()
     
-    def run_simulation(self, input_file_path):
+    def run_simulation(self, input_file_path, cpus=None):
         """
         Run a LAMMPS simulation.
         
         Args:
             input_file_path (Path): The path to the LAMMPS input file.
+            cpus (list, optional): CPU ids to pin the LAMMPS process to.
             
         Returns:
             dict: A dictionary with the simulation results.
@@ -215,21 +318,19 @@ class LAMMPSService:
             with open(input_file_path, 'r') as f:
                 input_content = f.read()
             
-            is_valid, message = self.validate_input_file(input_content)
+            is_valid, message, info = self._validate_input(input_content)
             if not is_valid:
                 return {
                     "success": False,
                     "message": message
                 }
             
-            # Ensure masses are set
-            modified_content = self.ensure_masses_set(input_content)
-            if modified_content != input_content:
-                # Write the modified content back to the input file
-                with open(input_file_path, 'w') as f:
-                    f.write(modified_content)
-                self.logger.info("Updated input file with mass settings")
-                input_content = modified_content
+            # Ensure masses are set (written once into the simulation directory)
+            if not info["masses_present"]:
+                modified_content = self.ensure_masses_set(input_content, masses_present=False)
+                if modified_content != input_content:
+                    self.logger.info("Updated input content with mass settings")
+                    input_content = modified_content
             
             # Extract the dump filename
             xyz_filename, velocity_filename = self.extract_dump_filename(input_content)
@@ -244,128 +345,134 @@ class LAMMPSService:
         
         # Always run the simulation locally
         self.logger.info("Running simulation locally")
-        return self._run_local_simulation(input_file_path, xyz_filename, velocity_filename)
+        return self._run_local_simulation(input_file_path, input_content, xyz_filename, velocity_filename, cpus)
     
-    def _run_local_simulation(self, input_file_path, xyz_filename=None, velocity_filename=None):
+    def _run_local_simulation(self, input_file_path, input_content, xyz_filename=None, velocity_filename=None,
+                              cpus=None):
         """
         Run a LAMMPS simulation locally.
         
         Args:
-            input_file_path (Path): The path to the LAMMPS input file.
+            input_file_path (Path): The path to the LAMMPS input file; files next to it are linked in too.
+            input_content (str): The validated input content to run.
             xyz_filename (str, optional): The expected XYZ dump filename from the input file.
             velocity_filename (str, optional): The expected velocity dump filename from the input file.
+            cpus (list, optional): CPU ids to pin the LAMMPS process to.
             
         Returns:
             dict: A dictionary with the simulation results.
         """
         # Create a temporary directory for the simulation
-        sim_id = os.urandom(4).hex()
-        tmpdir = self.simulations_dir / f"sim_{sim_id}"
+        # Draw the run, trajectory and velocity IDs from a single urandom call
+        random_bytes = os.urandom(12)
+        sim_id = random_bytes[:4].hex()
+        tmpdir = self.scratch_dir / f"sim_{sim_id}"
         tmpdir.mkdir(parents=True, exist_ok=True)
         
-        # Copy the input file to the temporary directory
+        # Write the input content to the temporary directory
         local_input_path = tmpdir / "input.lammps"
-        shutil.copy(input_file_path, local_input_path)
+        with open(local_input_path, 'w') as f:
+            f.write(input_content)
         
-        # Copy any potential files to the temporary directory
-        input_dir = input_file_path.parent
-        for file in input_dir.glob("*"):
-            if file.name != input_file_path.name and file.is_file():
-                shutil.copy(file, tmpdir / file.name)
-                self.logger.info(f"Copied potential file: {file.name} to simulation directory")
+        # Link any potential files into the temporary directory (LAMMPS only reads them)
+        with os.scandir(input_file_path.parent) as entries:
+            for entry in entries:
+                if entry.name == input_file_path.name or not entry.is_file():
+                    continue
+                try:
+                    os.symlink(os.path.realpath(entry.path), tmpdir / entry.name)
+                except (OSError, NotImplementedError):
+                    shutil.copy(entry.path, tmpdir / entry.name)
+                self.logger.info("Linked potential file: %s to simulation directory", entry.name)
         
         # Run the simulation
+        succeeded = False
         try:
-            self.logger.info(f"Running LAMMPS simulation in {tmpdir}")
+            self.logger.info("Running LAMMPS simulation in %s", tmpdir)
             start_time = time.time()
             
             # Run LAMMPS
             cmd = [self.lammps_exec, "-in", str(local_input_path)]
-            self.logger.info(f"Running command: {' '.join(cmd)}")
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=str(tmpdir),
-                text=True
-            )
+            if cpus and self._taskset:
+                cmd = [self._taskset, "-c", ",".join(map(str, cpus))] + cmd
+            self.logger.info("Running command: %s", ' '.join(cmd))
             
-            stdout, stderr = process.communicate()
+            # Stream the LAMMPS output straight to disk rather than buffering it in memory
+            stderr_path = tmpdir / "lammps.err"
+            with open(tmpdir / "lammps.log", "wb", buffering=LOG_BUFFER_SIZE) as out, \
+                    open(stderr_path, "wb", buffering=LOG_BUFFER_SIZE) as err:
+                returncode = self._runner(cmd, str(tmpdir), out, err)
             
             end_time = time.time()
             elapsed = end_time - start_time
             
-            self.logger.info(f"LAMMPS simulation completed in {elapsed:.2f} seconds")
-            self.logger.debug(f"LAMMPS stdout: {stdout}")
+            self.logger.info("LAMMPS simulation completed in %.2f seconds", elapsed)
             
-            if process.returncode != 0:
-                self.logger.error(f"LAMMPS simulation failed with exit code {process.returncode}")
-                self.logger.error(f"LAMMPS stderr: {stderr}")
+            if returncode != 0:
+                stderr = self._read_tail(stderr_path)
+                self.logger.error("LAMMPS simulation failed with exit code %s", returncode)
+                self.logger.error("LAMMPS stderr: %s", stderr)
                 return {
                     "success": False,
-                    "message": f"Simulation failed with exit code {process.returncode}: {stderr}"
+                    "message": f"Simulation failed with exit code {returncode}: {stderr}"
                 }
             
-            # Find trajectory files
-            trajectory_files = []
-            velocity_files = []
-            output_files = list(tmpdir.glob("*"))
+            # List the run directory once; symlinked inputs are not outputs
+            with os.scandir(tmpdir) as entries:
+                output_names = {entry.name for entry in entries if entry.is_file(follow_symlinks=False)}
             
             # Check for the specified files if provided
-            if xyz_filename and Path(tmpdir) / xyz_filename in output_files:
-                trajectory_files.append(Path(tmpdir) / xyz_filename)
-                self.logger.info(f"Found specified XYZ file: {xyz_filename}")
-            
-            if velocity_filename and Path(tmpdir) / velocity_filename in output_files:
-                velocity_files.append(Path(tmpdir) / velocity_filename)
-                self.logger.info(f"Found specified velocity file: {velocity_filename}")
-            
-            # If no trajectory files found, check for any dump files
-            if not trajectory_files:
-                for file in output_files:
-                    if file.name.endswith(".xyz") or "dump" in file.name.lower():
-                        trajectory_files.append(file)
-                        self.logger.info(f"Found trajectory file: {file.name}")
-            
-            # If no velocity files found, check for any velocity files
-            if not velocity_files:
-                for file in output_files:
-                    if file.name.endswith(".vel") or ("dump" in file.name.lower() and "vel" in file.name.lower()):
-                        velocity_files.append(file)
-                        self.logger.info(f"Found velocity file: {file.name}")
+            trajectory_file = self._find_output(tmpdir, output_names, xyz_filename)
+            if trajectory_file is not None:
+                self.logger.info("Found specified XYZ file: %s", xyz_filename)
+            
+            velocity_file = self._find_output(tmpdir, output_names, velocity_filename)
+            if velocity_file is not None:
+                self.logger.info("Found specified velocity file: %s", velocity_filename)
+            
+            # Only fall back to matching by name when a specified file is missing
+            if trajectory_file is None or velocity_file is None:
+                for output_name in sorted(output_names):
+                    name = output_name.lower()
+                    is_velocity = name.endswith(".vel") or ("dump" in name and "vel" in name)
+                    
+                    # If no trajectory file found, check for any dump files other than velocity dumps
+                    if trajectory_file is None and (name.endswith(".xyz") or ("dump" in name and not is_velocity)):
+                        trajectory_file = tmpdir / output_name
+                        self.logger.info("Found trajectory file: %s", output_name)
+                    
+                    # If no velocity file found, check for any velocity files
+                    if velocity_file is None and is_velocity:
+                        velocity_file = tmpdir / output_name
+                        self.logger.info("Found velocity file: %s", output_name)
             
             # If no trajectory files found, return an error
-            if not trajectory_files:
+            if trajectory_file is None:
                 self.logger.error("No trajectory files found")
                 return {
                     "success": False,
                     "message": "No trajectory files found"
                 }
             
-            # Use the first trajectory file for analysis
-            trajectory_file = trajectory_files[0]
-            velocity_file = velocity_files[0] if velocity_files else None
-            
-            # Copy the trajectory file to a more permanent location
-            trajectory_id = os.urandom(4).hex()
+            # Move the trajectory file to a more permanent location (a rename unless scratch is elsewhere)
+            trajectory_id = random_bytes[4:8].hex()
             permanent_trajectory = self.simulations_dir / f"trajectory_{trajectory_id}.xyz"
-            shutil.copy(trajectory_file, permanent_trajectory)
-            self.logger.info(f"Copied trajectory file to {permanent_trajectory}")
+            shutil.move(trajectory_file, permanent_trajectory)
+            self.logger.info("Moved trajectory file to %s", permanent_trajectory)
             
-            # Copy the velocity file to a more permanent location if it exists
+            # Move the velocity file to a more permanent location if it exists
             permanent_velocity = None
             if velocity_file:
-                velocity_id = os.urandom(4).hex()
+                velocity_id = random_bytes[8:].hex()
                 permanent_velocity = self.simulations_dir / f"velocity_{velocity_id}.vel"
-                shutil.copy(velocity_file, permanent_velocity)
-                self.logger.info(f"Copied velocity file to {permanent_velocity}")
+                shutil.move(velocity_file, permanent_velocity)
+                self.logger.info("Moved velocity file to %s", permanent_velocity)
             
             # Analyze the trajectory
-            from app.services.ase_service import ASEService
-            ase_service = ASEService()
+            if self._ase is None:
+                self._ase = ASEService()
             
-            analysis_result = ase_service.analyze_trajectory(
+            analysis_result = self._ase.analyze_trajectory(
                 trajectory_path=permanent_trajectory,
                 velocity_path=permanent_velocity
             )
@@ -373,6 +480,7 @@ class LAMMPSService:
             # Add the trajectory file ID to the result
             analysis_result["trajectory_file_id"] = trajectory_id
             
+            succeeded = True
             return {
                 "success": True,
                 "message": "Simulation completed successfully",
@@ -380,8 +488,75 @@ class LAMMPSService:
             }
             
         except Exception as e:
-            self.logger.exception(f"Error running LAMMPS simulation: {str(e)}")
+            self.logger.exception("Error running LAMMPS simulation: %s", e)
             return {
                 "success": False,
                 "message": f"Error running simulation: {str(e)}"
-            } 
\ No newline at end of file
+            }
+        finally:
+            # Keep the logs of a failed run next to the trajectories, then drop the run directory;
+            # the outputs that are kept have already been moved out
+            if not succeeded:
+                for log_name in ("lammps.log", "lammps.err"):
+                    log_path = tmpdir / log_name
+                    if log_path.exists():
+                        shutil.move(log_path, self.simulations_dir / f"failed_{sim_id}_{log_name}")
+                self.logger.info("Kept the logs of failed run %s in %s", sim_id, self.simulations_dir)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    
+    @staticmethod
+    def _run_subprocess(cmd, cwd, stdout, stderr):
+        """
+        Run a LAMMPS command as a local subprocess.
+        
+        Args:
+            cmd (list): The command to run.
+            cwd (str): The working directory of the run.
+            stdout (file): Binary file receiving standard output.
+            stderr (file): Binary file receiving standard error.
+            
+        Returns:
+            int: The exit code of the process.
+        """
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, cwd=cwd)
+        return process.wait()
+    
+    @staticmethod
+    def _find_output(tmpdir, output_names, filename):
+        """
+        Look up an expected output file of a run.
+        
+        Args:
+            tmpdir (Path): The run directory.
+            output_names (set): Names of the regular files in the run directory.
+            filename (str, optional): The expected filename from the input file.
+            
+        Returns:
+            Path: The path of the file, or None if it was not written.
+        """
+        if not filename:
+            return None
+        if filename in output_names:
+            return tmpdir / filename
+        # Dumps written into a subdirectory are not in the top-level listing
+        path = tmpdir / filename
+        if os.path.dirname(filename) and path.is_file():
+            return path
+        return None
+    
+    @staticmethod
+    def _read_tail(path, size=STDERR_TAIL_SIZE):
+        """
+        Read the end of a log file.
+        
+        Args:
+            path (Path): The path to the log file.
+            size (int): The maximum number of bytes to read from the end.
+            
+        Returns:
+            str: The decoded tail of the file.
+        """
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - size))
+            return f.read().decode(errors="replace") 
\ No newline at end of file
@@ -1,8 +1,85 @@
 import os
+import asyncio
 import logging
-import json
-import requests
-from typing import Dict, Any, Optional, List
+import re
+import httpx
+import orjson
+from typing import Dict, Any, Optional, List, AsyncIterator
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+# Retry rate-limited and transient server errors with exponential backoff
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.2
+
+# Commands a generated LAMMPS input must mention, matched in a single pass
+_REQUIRED_KEYWORDS = frozenset(["units", "atom_style", "run", "mass", "dump"])
+_RE_REQUIRED_KEYWORDS = re.compile(r'units|atom_style|run|mass|dump', re.IGNORECASE)
+
+# System message for LAMMPS input generation
+LAMMPS_SYSTEM_MESSAGE = """You are a scientific computing assistant specialized in molecular dynamics simulations with LAMMPS.
+Your task is to generate a valid LAMMPS input file based on the user's request.
+
+Guidelines:
+1. Write the input file in valid LAMMPS syntax.
+2. Specify essential simulation parameters including:
+   - 'units' (e.g., lj, metal, real, etc.),
+   - 'atom_style' (e.g., atomic, charge, etc.),
+   - 'boundary' conditions (e.g., p p p for periodic boundaries).
+3. Define the simulation box (using the 'region' command) and create atoms (using 'create_box' and 'create_atoms').
+4. **Explicitly set masses for all atom types** with the 'mass' command.
+5. Specify interatomic interactions with commands such as 'pair_style' and 'pair_coeff'.
+6. Set initial velocities using the 'velocity' command (ensure masses are set prior).
+7. Include TWO dump commands:
+   - One that outputs trajectory data in XYZ file format (positions)
+   - Another that outputs velocity data in a custom format including atom ID, type, vx, vy, vz
+   Example:
+   ```
+   dump 1 all xyz 100 dump.xyz
+   dump 2 all custom 100 dump.vel id type vx vy vz
+   ```
+8. Configure a simulation run with an appropriate 'run' command (suggest between 1000 and 10000 steps).
+9. Do not include any extra explanations or commentary—output only the raw LAMMPS input file content.
+10. If the user provides a potential file content, incorporate the parameters directly into the input file rather than using include or read_data commands.
+"""
+
+# System message for LAMMPS assistant
+ASSISTANT_SYSTEM_MESSAGE = """
+You are a helpful assistant specializing in molecular dynamics simulations with LAMMPS (Large-scale Atomic/Molecular Massively Parallel Simulator).
+Your role is to help users set up and understand LAMMPS simulations. You can:
+
+1. Explain LAMMPS commands and their parameters
+2. Suggest appropriate simulation settings for different materials and conditions
+3. Help troubleshoot common simulation issues
+4. Recommend best practices for molecular dynamics simulations
+5. Explain scientific concepts related to molecular dynamics
+
+When discussing simulation parameters, be specific about:
+- Appropriate units (real, metal, lj, etc.) for different types of simulations
+- Suitable timesteps for stability
+- Recommended ensemble choices (NVE, NVT, NPT) for different scenarios
+- Proper thermostat and barostat settings
+- Appropriate force fields for different materials
+
+You are also an expert on finding and using potential files for LAMMPS simulations. When users ask about potential files:
+
+1. Explain what potential files are and why they're important for accurate simulations
+2. Provide specific search terms and resources for finding potential files online
+3. Recommend reliable repositories and databases such as:
+   - NIST Interatomic Potentials Repository (https://www.ctcms.nist.gov/potentials/)
+   - OpenKIM (https://openkim.org/)
+   - LAMMPS potentials directory (https://lammps.sandia.gov/potentials.html)
+   - Materials Project (https://materialsproject.org/)
+   - GitHub repositories of research groups specializing in MD simulations
+4. Suggest appropriate keywords to search for specific material potentials (e.g., "EAM potential for copper", "MEAM Fe potential", "ReaxFF for hydrocarbons")
+5. Explain how to properly reference and cite potential files in research
+6. Provide guidance on how to validate potential files before using them in production simulations
+
+When a user uploads a potential file, help them understand how to properly reference it in their LAMMPS input script, including the correct pair_style and pair_coeff commands.
+
+Provide clear, concise explanations with scientific accuracy. When appropriate, suggest specific LAMMPS command examples.
+"""
 
 class OpenAIService:
     """Service for generating LAMMPS input files using OpenAI."""
@@ -16,11 +93,104 @@ class OpenAIService:
         """
         self.logger = logging.getLogger(__name__)
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        self._client: Optional[httpx.AsyncClient] = None
         
         if not self.api_key:
             self.logger.warning("OpenAI API key not provided. Service may not work correctly.")
     
-    def generate_lammps_input(self, prompt: str) -> str:
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        The pooled HTTP/2 client, created on first use so calls share one connection.
+        
+        Returns:
+            httpx.AsyncClient: The shared client.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                headers=self.headers,
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _post_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Call the chat completions endpoint, retrying rate limits and server errors.
+        
+        Args:
+            payload (Dict[str, Any]): The request body.
+            
+        Returns:
+            Dict[str, Any]: The decoded response.
+            
+        Raises:
+            httpx.HTTPError: If the request fails after all retries.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            response = await self.client.post(OPENAI_CHAT_URL, json=payload)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        
+        # Check for errors
+        response.raise_for_status()
+        
+        # Parse the response
+        return response.json()
+    
+    async def _stream_completion(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Call the chat completions endpoint with streaming and yield content deltas.
+        
+        Args:
+            payload (Dict[str, Any]): The request body, without the stream flag.
+            
+        Yields:
+            str: Each piece of generated content as it arrives.
+            
+        Raises:
+            httpx.HTTPError: If the request fails after all retries.
+        """
+        # Retry rate limits and server errors as _post_completion does; the status
+        # arrives before any content, so nothing has been yielded when retrying
+        request = self.client.build_request("POST", OPENAI_CHAT_URL, json={**payload, "stream": True})
+        for attempt in range(MAX_RETRIES + 1):
+            response = await self.client.send(request, stream=True)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            await response.aclose()
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        
+        try:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Server-sent events: one JSON chunk per "data:" line
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices")
+                if choices:
+                    content = choices[0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+        finally:
+            await response.aclose()
+    
+    async def generate_lammps_input(self, prompt: str) -> str:
         """
         Generate a LAMMPS input file from a natural language prompt.
         
@@ -37,66 +207,26 @@ class OpenAIService:
             raise ValueError("OpenAI API key is required but not provided.")
         
         try:
-            # Define the system message
-            system_message = """You are a scientific computing assistant specialized in molecular dynamics simulations with LAMMPS.
-Your task is to generate a valid LAMMPS input file based on the user's request.
-
-Guidelines:
-1. Write the input file in valid LAMMPS syntax.
-2. Specify essential simulation parameters including:
-   - 'units' (e.g., lj, metal, real, etc.),
-   - 'atom_style' (e.g., atomic, charge, etc.),
-   - 'boundary' conditions (e.g., p p p for periodic boundaries).
-3. Define the simulation box (using the 'region' command) and create atoms (using 'create_box' and 'create_atoms').
-4. **Explicitly set masses for all atom types** with the 'mass' command.
-5. Specify interatomic interactions with commands such as 'pair_style' and 'pair_coeff'.
-6. Set initial velocities using the 'velocity' command (ensure masses are set prior).
-7. Include TWO dump commands:
-   - One that outputs trajectory data in XYZ file format (positions)
-   - Another that outputs velocity data in a custom format including atom ID, type, vx, vy, vz
-   Example:
-   ```
-   dump 1 all xyz 100 dump.xyz
-   dump 2 all custom 100 dump.vel id type vx vy vz
-   ```
-8. Configure a simulation run with an appropriate 'run' command (suggest between 1000 and 10000 steps).
-9. Do not include any extra explanations or commentary—output only the raw LAMMPS input file content.
-10. If the user provides a potential file content, incorporate the parameters directly into the input file rather than using include or read_data commands.
-"""
-
-            # Make the API call
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": [
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": f"Generate a LAMMPS input file for: {prompt}"}
-                    ],
-                    "temperature": 0.2,
-                    "max_tokens": 2000
-                }
-            )
-            
-            # Check for errors
-            response.raise_for_status()
+            # Make the API call, collecting the streamed pieces
+            parts = [content async for content in self._stream_completion({
+                "model": "gpt-4o",
+                "messages": [
+                    {"role": "system", "content": LAMMPS_SYSTEM_MESSAGE},
+                    {"role": "user", "content": f"Generate a LAMMPS input file for: {prompt}"}
+                ],
+                "temperature": 0.2,
+                "max_tokens": 2000
+            })]
             
-            # Parse the response
-            response_data = response.json()
-            
-            if "choices" not in response_data or len(response_data["choices"]) == 0:
+            if not parts:
                 raise ValueError("Unexpected response format from OpenAI API")
             
             # Extract the generated input file
-            generated_text = response_data["choices"][0]["message"]["content"].strip()
+            generated_text = ''.join(parts).strip()
             
             return generated_text
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             self.logger.error(f"Error calling OpenAI API: {str(e)}")
             raise Exception(f"Failed to generate LAMMPS input: {str(e)}")
         except Exception as e:
@@ -113,20 +243,16 @@ Guidelines:
         Returns:
             bool: True if the content appears to be valid LAMMPS input, False otherwise.
         """
-        # Check for some basic LAMMPS commands that should be present
-        required_keywords = ["units", "atom_style", "run", "mass"]
-        
-        for keyword in required_keywords:
-            if keyword not in input_content.lower():
-                return False
+        # Check for the basic LAMMPS commands, including a dump command for output
+        found = set()
+        for match in _RE_REQUIRED_KEYWORDS.finditer(input_content):
+            found.add(match.group().lower())
+            if len(found) == len(_REQUIRED_KEYWORDS):
+                return True
         
-        # Check that it has a dump command for output
-        if "dump" not in input_content.lower():
-            return False
+        return False
         
-        return True
-        
-    def chat_with_assistant(self, conversation_history: List[Dict[str, str]]) -> str:
+    async def chat_with_assistant(self, conversation_history: List[Dict[str, str]]) -> str:
         """
         Chat with a LAMMPS simulation assistant.
         
@@ -143,67 +269,17 @@ Guidelines:
             raise ValueError("OpenAI API key is required but not provided.")
         
         try:
-            # System message for LAMMPS assistant
-            system_message = """
-You are a helpful assistant specializing in molecular dynamics simulations with LAMMPS (Large-scale Atomic/Molecular Massively Parallel Simulator).
-Your role is to help users set up and understand LAMMPS simulations. You can:
-
-1. Explain LAMMPS commands and their parameters
-2. Suggest appropriate simulation settings for different materials and conditions
-3. Help troubleshoot common simulation issues
-4. Recommend best practices for molecular dynamics simulations
-5. Explain scientific concepts related to molecular dynamics
-
-When discussing simulation parameters, be specific about:
-- Appropriate units (real, metal, lj, etc.) for different types of simulations
-- Suitable timesteps for stability
-- Recommended ensemble choices (NVE, NVT, NPT) for different scenarios
-- Proper thermostat and barostat settings
-- Appropriate force fields for different materials
-
-You are also an expert on finding and using potential files for LAMMPS simulations. When users ask about potential files:
-
-1. Explain what potential files are and why they're important for accurate simulations
-2. Provide specific search terms and resources for finding potential files online
-3. Recommend reliable repositories and databases such as:
-   - NIST Interatomic Potentials Repository (https://www.ctcms.nist.gov/potentials/)
-   - OpenKIM (https://openkim.org/)
-   - LAMMPS potentials directory (https://lammps.sandia.gov/potentials.html)
-   - Materials Project (https://materialsproject.org/)
-   - GitHub repositories of research groups specializing in MD simulations
-4. Suggest appropriate keywords to search for specific material potentials (e.g., "EAM potential for copper", "MEAM Fe potential", "ReaxFF for hydrocarbons")
-5. Explain how to properly reference and cite potential files in research
-6. Provide guidance on how to validate potential files before using them in production simulations
-
-When a user uploads a potential file, help them understand how to properly reference it in their LAMMPS input script, including the correct pair_style and pair_coeff commands.
-
-Provide clear, concise explanations with scientific accuracy. When appropriate, suggest specific LAMMPS command examples.
-"""
-
             # Prepare messages including system message
-            messages = [{"role": "system", "content": system_message}]
+            messages = [{"role": "system", "content": ASSISTANT_SYSTEM_MESSAGE}]
             messages.extend(conversation_history)
             
             # Make the API call
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": messages,
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                }
-            )
-            
-            # Check for errors
-            response.raise_for_status()
-            
-            # Parse the response
-            response_data = response.json()
+            response_data = await self._post_completion({
+                "model": "gpt-4o",
+                "messages": messages,
+                "temperature": 0.7,
+                "max_tokens": 1000
+            })
             
             if "choices" not in response_data or len(response_data["choices"]) == 0:
                 raise ValueError("Unexpected response format from OpenAI API")
@@ -213,9 +289,41 @@ Provide clear, concise explanations with scientific accuracy. When appropriate,
             
             return assistant_response
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             self.logger.error(f"Error calling OpenAI API: {str(e)}")
             raise Exception(f"Failed to get assistant response: {str(e)}")
         except Exception as e:
             self.logger.error(f"Error in chat_with_assistant: {str(e)}")
-            raise Exception(f"Failed to get assistant response: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to get assistant response: {str(e)}")
+    
+    async def stream_chat_with_assistant(self, conversation_history: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Chat with a LAMMPS simulation assistant, streaming the response.
+        
+        Args:
+            conversation_history (List[Dict[str, str]]): The conversation history.
+            
+        Yields:
+            str: Each piece of the assistant's response as it arrives.
+            
+        Raises:
+            Exception: If the API call fails or no API key is provided.
+        """
+        if not self.api_key:
+            raise ValueError("OpenAI API key is required but not provided.")
+        
+        try:
+            # Prepare messages including system message
+            messages = [{"role": "system", "content": ASSISTANT_SYSTEM_MESSAGE}]
+            messages.extend(conversation_history)
+            
+            async for content in self._stream_completion({
+                "model": "gpt-4o",
+                "messages": messages,
+                "temperature": 0.7,
+                "max_tokens": 1000
+            }):
+                yield content
+        except httpx.HTTPError as e:
+            self.logger.error(f"Error calling OpenAI API: {str(e)}")
+            raise Exception(f"Failed to get assistant response: {str(e)}")
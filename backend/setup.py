@@ -7,8 +7,14 @@ setup(
     install_requires=[
         "fastapi==0.95.1",
         "uvicorn==0.22.0",
+        'uvloop==0.17.0; sys_platform != "win32"',
+        "httptools==0.5.0",
         "pytest==7.3.1",
+        "pytest-xdist==3.3.1",
+        "pytest-asyncio==0.21.0",
+        "testcontainers==3.7.1",
         "httpx==0.24.0",
+        "h2==4.1.0",
         "python-multipart==0.0.6",
         "ase==3.22.1",
         "numpy==1.24.3",
@@ -16,5 +22,8 @@ setup(
         "pydantic==1.10.7",
         "docker==6.1.2",
         "python-dotenv==1.0.0",
+        "aiofiles==23.1.0",
+        "orjson==3.9.1",
+        "cachetools==5.3.1",
     ],
 ) 
\ No newline at end of file
@@ -1,7 +1,205 @@
+import os
+import uuid
+import shutil
+import tempfile
+import functools
+import hashlib
+from pathlib import Path
 import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+# LAMMPS image built from backend/Dockerfile, tagged with a hash of the Dockerfile
+LAMMPS_IMAGE_REPO = "materavista-lammps"
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Small Lennard-Jones argon run shared by the real-LAMMPS API tests
+LJ_INPUT = """
+# Simple Lennard-Jones simulation of argon
+units           lj
+atom_style      atomic
+boundary        p p p
+
+# Create simulation box and atoms
+lattice         fcc 0.8442
+region          box block 0 4 0 4 0 4
+create_box      1 box
+create_atoms    1 box
+mass            1 1.0
+
+# Define potential
+pair_style      lj/cut 2.5
+pair_coeff      1 1 1.0 1.0 2.5
+
+# Settings
+neighbor        0.3 bin
+neigh_modify    every 1 delay 0 check yes
+
+# Run simulation
+dump            1 all xyz 10 simulation.xyz
+thermo          100
+timestep        0.005
+run             100
+"""
 
 def pytest_configure(config):
     """Configure pytest with custom markers."""
     config.addinivalue_line(
         "markers", "integration: mark test as an integration test that requires external dependencies"
-    ) 
\ No newline at end of file
+    )
+
+@pytest.fixture(scope="session", autouse=True)
+def xdist_worker_tempdir():
+    """Give each pytest-xdist worker its own temp directory, so test simulation directories do not collide."""
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if not worker:
+        yield
+        return
+    worker_dir = Path(tempfile.gettempdir()) / f"materavista_{worker}"
+    worker_dir.mkdir(exist_ok=True)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(tempfile, "tempdir", str(worker_dir))
+        yield
+
+@pytest.fixture(scope="session")
+def lammps_result():
+    """Run the shared LJ simulation through the API once per test session."""
+    response = TestClient(app).post("/run-lammps/", json={"input_content": LJ_INPUT})
+    assert response.status_code == 200
+    return response.json()
+
+@pytest.fixture(scope="session")
+def native_lmp():
+    """Path of a LAMMPS binary on PATH, or None when simulations must run in Docker."""
+    return shutil.which("lmp")
+
+@functools.lru_cache(maxsize=4)
+def _lammps_image_available(client, tag):
+    """
+    Check once whether a LAMMPS image is present.
+    
+    Setting DOCKER_IMAGE_PRESENT=1 (e.g. in CI right after building the image) skips
+    the daemon round trip, which otherwise every pytest-xdist worker would pay.
+    
+    Args:
+        client (DockerClient): The Docker client.
+        tag (str): The image tag to look up.
+        
+    Returns:
+        bool: True if the image is available.
+    """
+    if os.environ.get("DOCKER_IMAGE_PRESENT") == "1":
+        return True
+    import docker
+    try:
+        client.images.get(tag)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+def _dockerfile_hash():
+    """
+    Hash the LAMMPS Dockerfile, which is all the image is built from.
+    
+    Tagging by content rather than by commit picks up uncommitted Dockerfile
+    changes and lets commits that leave it untouched share an image.
+    
+    Returns:
+        str: The first 12 hex digits of the Dockerfile's SHA-256.
+    """
+    return hashlib.sha256((BACKEND_DIR / "Dockerfile").read_bytes()).hexdigest()[:12]
+
+@pytest.fixture(scope="session")
+def docker_client():
+    """Connect to Docker once per test session."""
+    # Docker-only dependencies are imported here, so unit tests run without them
+    docker = pytest.importorskip("docker")
+    try:
+        client = docker.from_env()
+        client.ping()  # Check if Docker daemon is responsive
+    except Exception as e:
+        pytest.skip(f"Docker not available: {str(e)}")
+    
+    yield client
+    client.close()
+
+@pytest.fixture(scope="session")
+def lammps_image(docker_client, tmp_path_factory):
+    """
+    Tag of the LAMMPS image for the current Dockerfile, built only when it is not present yet.
+    
+    Builds reuse the layers of the previous build (tagged latest). Under pytest-xdist
+    the build runs under a file lock shared by all workers, so only the first worker
+    builds and the others reuse its image.
+    """
+    import docker
+    tag = f"{LAMMPS_IMAGE_REPO}:{_dockerfile_hash()}"
+    if _lammps_image_available(docker_client, tag):
+        return tag
+    
+    # fcntl is POSIX-only, like the same-path tmp mount the container relies on
+    fcntl = pytest.importorskip("fcntl")
+    
+    # The parent of the base temp directory is shared by all xdist workers
+    lock_path = tmp_path_factory.getbasetemp().parent / "lammps_image.lock"
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        
+        # Another worker may have built the image while we waited
+        _lammps_image_available.cache_clear()
+        if _lammps_image_available(docker_client, tag):
+            return tag
+        
+        try:
+            image, _ = docker_client.images.build(
+                path=str(BACKEND_DIR),
+                dockerfile="Dockerfile",
+                tag=tag,
+                cache_from=[f"{LAMMPS_IMAGE_REPO}:latest"],
+            )
+        except (docker.errors.BuildError, docker.errors.APIError) as e:
+            pytest.skip(f"Could not build the LAMMPS Docker image: {str(e)}")
+        image.tag(LAMMPS_IMAGE_REPO, "latest")
+    return tag
+
+@pytest.fixture(scope="session")
+def lammps_container(docker_client, lammps_image):
+    """Start one long-lived LAMMPS container that simulations are executed in."""
+    DockerContainer = pytest.importorskip("testcontainers.core.container").DockerContainer
+    
+    # Mount the temp directory at the same path so run directories resolve identically
+    tmp = tempfile.gettempdir()
+    container = (
+        DockerContainer(lammps_image, entrypoint="sleep")
+        .with_command("infinity")
+        .with_volume_mapping(tmp, tmp, "rw")
+        .with_name(f"lammps-test-{uuid.uuid4().hex[:8]}")
+    )
+    with container:
+        yield container.get_wrapped_container()
+
+def run_in_container(container, cmd, cwd, stdout, stderr):
+    """
+    Run a LAMMPS command in a running container.
+    
+    Args:
+        container (Container): The container to execute in.
+        cmd (list): The command to run.
+        cwd (str): The working directory of the run.
+        stdout (file): Binary file receiving standard output.
+        stderr (file): Binary file receiving standard error.
+        
+    Returns:
+        int: The exit code of the command.
+    """
+    result = container.exec_run(cmd, workdir=cwd, demux=True)
+    out, err = result.output
+    stdout.write(out or b"")
+    stderr.write(err or b"")
+    return result.exit_code
+
+@pytest.fixture(scope="session")
+def container_runner(lammps_container):
+    """LAMMPSService runner that executes in the shared LAMMPS container."""
+    return functools.partial(run_in_container, lammps_container)
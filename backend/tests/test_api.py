@@ -1,4 +1,5 @@
 import os
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest import mock
@@ -13,50 +14,14 @@ def test_health_check():
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
-def test_run_lammps_with_valid_input():
+@pytest.mark.integration
+def test_run_lammps_with_valid_input(lammps_result):
     """Test running a LAMMPS simulation with valid input."""
-    # Prepare test data
-    input_content = """
-    # Simple Lennard-Jones simulation of argon
-    units           lj
-    atom_style      atomic
-    boundary        p p p
-    
-    # Create simulation box and atoms
-    lattice         fcc 0.8442
-    region          box block 0 4 0 4 0 4
-    create_box      1 box
-    create_atoms    1 box
-    mass            1 1.0
-    
-    # Define potential
-    pair_style      lj/cut 2.5
-    pair_coeff      1 1 1.0 1.0 2.5
-    
-    # Settings
-    neighbor        0.3 bin
-    neigh_modify    every 1 delay 0 check yes
-    
-    # Run simulation
-    dump            1 all xyz 10 simulation.xyz
-    thermo          100
-    timestep        0.005
-    run             100
-    """
-    
-    # Run the test with actual simulation
-    response = client.post(
-        "/run-lammps/",
-        json={"input_content": input_content}
-    )
-    
-    # Check the response
-    assert response.status_code == 200
-    result = response.json()
-    assert "msd" in result
-    assert "potential_energy" in result
-    assert len(result["msd"]) > 0
-    assert len(result["potential_energy"]) > 0
+    # Check the response of the shared simulation run
+    assert "msd" in lammps_result
+    assert "potential_energy" in lammps_result
+    assert len(lammps_result["msd"]) > 0
+    assert len(lammps_result["potential_energy"]) > 0
 
 def test_run_lammps_with_invalid_input():
     """Test running a LAMMPS simulation with invalid input."""
@@ -97,4 +62,338 @@ def test_generate_lammps_input():
     assert "input_content" in result
     assert "temperature" in result["input_content"]
     assert "timestep" in result["input_content"]
-    assert "run" in result["input_content"] 
\ No newline at end of file
+    assert "run" in result["input_content"]
+
+
+def test_upload_potential_file():
+    """Test uploading a potential file streams it to disk."""
+    content = b"# LJ potential\npair_coeff 1 1 1.0 1.0 2.5\n"
+    
+    response = client.post(
+        "/upload-potential/",
+        files={"file": ("lj.potential", content, "text/plain")}
+    )
+    
+    assert response.status_code == 200
+    result = response.json()
+    assert result["filename"] == "lj.potential"
+    assert "potential_file_id" in result
+
+def test_upload_potential_file_saves_streamed_content():
+    """Test that the database record gets the content decoded while streaming the upload."""
+    from app.main import db_service
+    
+    content = "pair_coeff 1 1 1.0 1.0 2.5\n" * 100_000
+    with mock.patch("app.main.UPLOAD_CHUNK_SIZE", 4096), \
+         mock.patch.object(db_service, "save_potential_file", mock.AsyncMock(return_value={})) as save:
+        response = client.post("/upload-potential/", files={"file": ("lj.potential", content.encode())})
+    
+    assert response.status_code == 200
+    assert save.await_args.kwargs["content"] == content
+
+def test_upload_potential_file_rejects_non_utf8():
+    """Test that uploads that are not UTF-8 text are rejected and not kept on disk."""
+    from app.main import TEMP_DIR, db_service
+    
+    before = set(TEMP_DIR.glob("potential_*"))
+    with mock.patch.object(db_service, "save_potential_file", mock.AsyncMock(return_value={})) as save:
+        response = client.post("/upload-potential/", files={"file": ("lj.potential", b"pair_coeff \xff\xfe\n")})
+    
+    assert response.status_code == 400
+    save.assert_not_awaited()
+    assert set(TEMP_DIR.glob("potential_*")) == before
+
+def test_upload_potential_file_ids_are_unguessable():
+    """Test that upload IDs are random rather than a shared prefix plus a counter."""
+    with mock.patch("app.main.db_service", None):
+        ids = [
+            client.post("/upload-potential/", files={"file": ("lj.potential", b"pair_coeff 1 1\n")}).json()["potential_file_id"]
+            for _ in range(2)
+        ]
+    
+    assert all(len(file_id) == 32 for file_id in ids)
+    assert ids[0][:8] != ids[1][:8]
+
+def test_fast_clone_potential_file(tmp_path):
+    """Test that potential files are cloned read-only with identical content."""
+    from app.main import _fast_clone
+    
+    src = tmp_path / "potential.lmp"
+    src.write_text("pair_coeff 1 1 1.0 1.0 2.5\n")
+    dst = tmp_path / "sim" / "potential.lmp"
+    dst.parent.mkdir()
+    
+    _fast_clone(src, dst)
+    
+    assert dst.read_text() == src.read_text()
+    assert dst.stat().st_mode & 0o777 == 0o444
+
+def test_json_safe_replaces_non_finite_values():
+    """Test that NaN, infinite and None values are converted to None."""
+    from app.main import _json_safe
+    
+    values = [0.0, float("nan"), 1.5, float("inf"), None, -float("inf")]
+    
+    assert _json_safe(values) == [0.0, None, 1.5, None, None, None]
+
+def test_get_unknown_trajectory_file():
+    """Test that requesting an unknown trajectory file returns 404."""
+    response = client.get("/trajectory/does-not-exist")
+    assert response.status_code == 404
+
+def test_run_lammps_with_unknown_potential_file():
+    """Test that referencing an unknown potential file returns 404."""
+    response = client.post(
+        "/run-lammps/",
+        json={"input_content": "units lj", "potential_file_id": "does-not-exist"}
+    )
+    assert response.status_code == 404
+
+def test_get_trajectory_file():
+    """Test downloading a trajectory file by ID."""
+    from app.main import lammps_service
+    
+    trajectory = lammps_service.simulations_dir / "trajectory_testfile.xyz"
+    trajectory.write_text("1\nAtoms\nAr 0.0 0.0 0.0\n")
+    try:
+        response = client.get("/trajectory/testfile")
+        assert response.status_code == 200
+        assert response.text == "1\nAtoms\nAr 0.0 0.0 0.0\n"
+        assert "trajectory.xyz" in response.headers["content-disposition"]
+    finally:
+        trajectory.unlink()
+
+def test_cleanup_removes_expired_simulations(tmp_path):
+    """Test that the cleanup endpoint removes simulation directories past their age."""
+    import heapq
+    import time
+    from app import main
+    
+    expired_dir = tmp_path / "sim_expired"
+    fresh_dir = tmp_path / "sim_fresh"
+    expired_dir.mkdir()
+    fresh_dir.mkdir()
+    
+    with main._SIM_LOCK:
+        heapq.heappush(main._SIM_HEAP, (time.time() - main.SIM_MAX_AGE - 1, expired_dir))
+        heapq.heappush(main._SIM_HEAP, (time.time(), fresh_dir))
+    
+    response = client.post("/cleanup/")
+    
+    assert response.status_code == 204
+    assert not expired_dir.exists()
+    assert fresh_dir.exists()
+
+def test_db_service_client_lifecycle():
+    """Test that the database service reuses one pooled client and closes it on shutdown."""
+    from app.main import db_service
+    
+    with TestClient(app):
+        http_client = db_service.client
+        assert db_service.client is http_client
+    
+    assert http_client.is_closed
+    assert db_service._client is None
+
+def test_run_lammps_records_simulation_in_database():
+    """Test that database records are created alongside the simulation run."""
+    from app.main import db_service, lammps_service
+    
+    result = {
+        "success": True,
+        "message": "Simulation completed successfully",
+        "analysis": {
+            "msd": [0.0, float("nan"), 0.2],
+            "kinetic_energy": [1.0, 1.1, 1.2],
+            "frames": 3,
+            "atoms": 4,
+            "trajectory_file_id": "abc",
+        },
+    }
+    
+    with mock.patch.object(db_service, "create_simulation_with_input",
+                           mock.AsyncMock(return_value={"id": "sim-1", "input": {"id": "input-1"}})) as create_simulation, \
+         mock.patch.object(db_service, "update_simulation_results", mock.AsyncMock(return_value={})), \
+         mock.patch.object(lammps_service, "run_simulation", return_value=result):
+        response = client.post("/run-lammps/", json={"input_content": "units lj"})
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["simulation_id"] == "sim-1"
+    assert body["msd"] == [0.0, None, 0.2]
+    create_simulation.assert_awaited_once()
+    assert create_simulation.await_args.kwargs["content"] == "units lj"
+
+def test_chat_continues_server_side_session():
+    """Test that a chat session can be continued without resending the history."""
+    from app.main import openai_service
+    
+    with mock.patch.object(openai_service, "chat_with_assistant", side_effect=["first", "second"]) as chat:
+        first = client.post("/chat/", json={"message": "hello", "conversation_history": []})
+        session_id = first.json()["session_id"]
+        second = client.post("/chat/", json={"message": "again", "session_id": session_id})
+    
+    assert first.json()["conversation_history"][-1] == {"role": "assistant", "content": "first"}
+    assert second.json()["response"] == "second"
+    assert second.json()["conversation_history"] is None
+    assert [m["content"] for m in chat.call_args.args[0]] == ["hello", "first", "again", "second"]
+
+def test_chat_session_is_bound_to_its_owner():
+    """Test that another user cannot continue a chat session by its ID."""
+    from app.main import openai_service
+    
+    with mock.patch.object(openai_service, "chat_with_assistant", return_value="first"):
+        first = client.post("/chat/", json={"message": "hello"}, headers={"user-id": "alice"})
+        session_id = first.json()["session_id"]
+        second = client.post("/chat/", json={"message": "again", "session_id": session_id},
+                             headers={"user-id": "mallory"})
+    
+    assert len(session_id) >= 43
+    assert second.status_code == 404
+
+def test_chat_unknown_session_falls_back_to_sent_history():
+    """Test that an expired session is rebuilt from the history resent by the client."""
+    from app.main import openai_service
+    
+    history = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "first"}]
+    with mock.patch.object(openai_service, "chat_with_assistant", return_value="second") as chat:
+        missing = client.post("/chat/", json={"message": "again", "session_id": "expired"})
+        resent = client.post("/chat/", json={"message": "again", "session_id": "expired",
+                                             "conversation_history": history})
+    
+    assert missing.status_code == 404
+    assert chat.await_count == 1
+    assert resent.json()["session_id"] != "expired"
+    assert [m["content"] for m in resent.json()["conversation_history"]] == ["hello", "first", "again", "second"]
+
+def test_chat_failed_reply_leaves_session_untouched():
+    """Test that the user turn is only stored once the assistant has replied."""
+    from app.main import openai_service, _CHAT_SESSIONS
+    
+    with mock.patch.object(openai_service, "chat_with_assistant", side_effect=["first", RuntimeError("down")]):
+        session_id = client.post("/chat/", json={"message": "hello"}).json()["session_id"]
+        failed = client.post("/chat/", json={"message": "again", "session_id": session_id})
+    
+    assert failed.status_code == 500
+    assert [m["content"] for m in _CHAT_SESSIONS[session_id][1]] == ["hello", "first"]
+
+def test_db_service_execute_query_serializes_numpy():
+    """Test that GraphQL payloads are encoded with orjson, including NumPy arrays."""
+    import asyncio
+    import httpx
+    import numpy as np
+    import orjson
+    from app.services.db_service import DBService
+    
+    requests = []
+    
+    def handler(request):
+        requests.append(orjson.loads(request.content))
+        return httpx.Response(200, content=orjson.dumps({"data": {"simulations_by_pk": {"id": "sim-1"}}}))
+    
+    service = DBService()
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    
+    result = asyncio.run(service._execute_query("query", {"msd": np.array([0.0, 0.5])}))
+    
+    assert result == {"id": "sim-1"}
+    assert requests[0]["variables"] == {"msd": [0.0, 0.5]}
+
+def test_db_service_dumps_series():
+    """Test that per-frame series are serialized from arrays with NaN as null."""
+    import numpy as np
+    from app.services.db_service import DBService
+    
+    assert DBService._dumps_series(np.array([0.0, np.nan, 0.5])) == "[0.0,null,0.5]"
+    assert DBService._dumps_series(np.array([])) is None
+    assert DBService._dumps_series(None) is None
+
+def test_db_service_execute_query_gzips_large_payloads(monkeypatch):
+    """Test that large GraphQL payloads are gzip-compressed when enabled."""
+    import asyncio
+    import gzip
+    import httpx
+    import orjson
+    from app.services import db_service as db_module
+    
+    monkeypatch.setattr(db_module, "HASURA_GZIP_REQUESTS", True)
+    requests = []
+    
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=orjson.dumps({"data": {"update_simulations_by_pk": {"id": "sim-1"}}}))
+    
+    service = db_module.DBService()
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    
+    asyncio.run(service._execute_query("small", {}))
+    asyncio.run(service._execute_query("large", {"msd": [0.5] * 2000}))
+    
+    assert "content-encoding" not in requests[0].headers
+    assert requests[1].headers["content-encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(requests[1].content))["variables"]["msd"] == [0.5] * 2000
+
+def test_openai_service_reuses_client():
+    """Test that OpenAI calls share the pooled client, stream generation and retry rate limits."""
+    import asyncio
+    import httpx
+    from app.services import openai_service as openai_module
+    
+    chat_statuses = [429, 200]
+    stream_statuses = [503, 200]
+    requests = []
+    
+    def handler(request):
+        requests.append(request)
+        if json.loads(request.content).get("stream"):
+            if stream_statuses.pop(0) != 200:
+                return httpx.Response(503)
+            chunks = [{"choices": [{"delta": {"content": piece}}]} for piece in (" units", " lj \n")]
+            body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(chat_statuses.pop(0), json={"choices": [{"message": {"content": " hello \n"}}]})
+    
+    service = openai_module.OpenAIService(api_key="test-key")
+    service._client = httpx.AsyncClient(headers=service.headers, transport=httpx.MockTransport(handler))
+    
+    async def run():
+        with mock.patch.object(openai_module, "RETRY_BACKOFF", 0):
+            generated = await service.generate_lammps_input("argon")
+            reply = await service.chat_with_assistant([{"role": "user", "content": "hi"}])
+        await service.aclose()
+        return generated, reply
+    
+    assert asyncio.run(run()) == ("units lj", "hello")
+    assert len(requests) == 4
+    assert requests[0].headers["Authorization"] == "Bearer test-key"
+    assert service._client is None
+
+def test_chat_stream_emits_deltas_and_stores_session():
+    """Test that the streaming chat endpoint relays deltas and keeps the session."""
+    from app.main import openai_service, _CHAT_SESSIONS
+    
+    async def stream(conversation_history):
+        for content in ("Use ", "units lj."):
+            yield content
+    
+    with mock.patch.object(openai_service, "stream_chat_with_assistant", stream):
+        response = client.post("/chat/stream/", json={"message": "hello", "conversation_history": []})
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [line[len("data: "):] for line in response.text.split("\n\n") if line]
+    session_id = json.loads(events[0])["session_id"]
+    assert [json.loads(event)["delta"] for event in events[1:-1]] == ["Use ", "units lj."]
+    assert events[-1] == "[DONE]"
+    assert _CHAT_SESSIONS[session_id][1][-1] == {"role": "assistant", "content": "Use units lj."}
+
+def test_openai_service_is_valid_lammps_input():
+    """Test the single-pass keyword check for generated LAMMPS input."""
+    from app.services.openai_service import OpenAIService
+    
+    service = OpenAIService()
+    valid = "UNITS lj\natom_style atomic\nmass 1 1.0\ndump 1 all xyz 10 dump.xyz\nrun 100\n"
+    
+    assert service._is_valid_lammps_input(valid)
+    assert not service._is_valid_lammps_input(valid.replace("dump 1 all xyz 10 dump.xyz", ""))
+    assert not service._is_valid_lammps_input("")
@@ -1,9 +1,10 @@
+import asyncio
 import pytest
+import httpx
 from fastapi.testclient import TestClient
 import json
 import os
 from pathlib import Path
-import tempfile
 
 from app.main import app
 from app.services.lammps_service import LAMMPSService
@@ -49,8 +50,10 @@ def sample_input_content():
     run             100
     """
 
-def test_end_to_end_pipeline():
-    """Test the complete end-to-end pipeline."""
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_end_to_end_pipeline(sample_input_content):
+    """Test the complete end-to-end pipeline, running the input variants concurrently."""
     # Prepare test data
     input_content = """
     # Simple Lennard-Jones simulation of argon
@@ -80,19 +83,21 @@ def test_end_to_end_pipeline():
     run             100
     """
 
-    # Run the simulation
-    response = client.post(
-        "/run-lammps/",
-        json={"input_content": input_content}
-    )
+    # Run the simulations concurrently on one event loop
+    async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+        responses = await asyncio.gather(*(
+            ac.post("/run-lammps/", json={"input_content": content})
+            for content in (input_content, sample_input_content)
+        ))
 
-    # Check the response
-    assert response.status_code == 200
-    result = response.json()
-    assert "msd" in result
-    assert "potential_energy" in result
-    assert len(result["msd"]) > 0
-    assert len(result["potential_energy"]) > 0
+    # Check the responses
+    for response in responses:
+        assert response.status_code == 200
+        result = response.json()
+        assert "msd" in result
+        assert "potential_energy" in result
+        assert len(result["msd"]) > 0
+        assert len(result["potential_energy"]) > 0
 
 def test_health_check_integration():
     """Test the health check endpoint in an integration context."""
@@ -1,24 +1,30 @@
 import os
+import mmap
+import logging
 import pytest
-import tempfile
-import json
+import shutil
+import orjson
 import time
-from pathlib import Path
 
 from app.services.lammps_service import LAMMPSService
 from app.services.ase_service import ASEService
 
-@pytest.fixture
-def lammps_service():
-    """Fixture to create a real LAMMPS service instance."""
-    return LAMMPSService()
+# Run details are logged at DEBUG; show them with `pytest --log-cli-level=DEBUG`
+logger = logging.getLogger(__name__)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
+def lammps_service(request, native_lmp):
+    """Fixture to create a real LAMMPS service, running lmp natively when installed and in Docker otherwise."""
+    if native_lmp:
+        return LAMMPSService()
+    return LAMMPSService(runner=request.getfixturevalue("container_runner"))
+
+@pytest.fixture(scope="module")
 def ase_service():
     """Fixture to create an ASE service instance."""
     return ASEService()
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def simple_lammps_input():
     """Fixture to create a simple LAMMPS input file for testing."""
     return """
@@ -57,132 +63,125 @@ timestep        0.005
 run             100
 """
 
+@pytest.fixture(scope="module")
+def simple_lammps_input_path(tmp_path_factory, simple_lammps_input):
+    """Fixture to write the simple LAMMPS input once per module."""
+    path = tmp_path_factory.mktemp("lammps") / "in.lj"
+    path.write_text(simple_lammps_input)
+    return path
+
+@pytest.fixture(scope="module")
+def lammps_trajectory(lammps_service, simple_lammps_input_path, tmp_path_factory):
+    """Run the simple LAMMPS simulation once per module and share its result, log, trajectory and run time."""
+    # Create input file
+    input_file = tmp_path_factory.mktemp("run") / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    # Capture the LAMMPS output before the run directory is removed
+    logs = []
+    runner = lammps_service._runner
+    
+    def capture_log(cmd, cwd, stdout, stderr):
+        returncode = runner(cmd, cwd, stdout, stderr)
+        stdout.flush()
+        with open(os.path.join(cwd, "lammps.log"), "r") as f:
+            logs.append(f.read())
+        return returncode
+    
+    # Run the simulation
+    lammps_service._runner = capture_log
+    try:
+        start_time = time.time()
+        result = lammps_service.run_simulation(input_file)
+        elapsed = time.time() - start_time
+    finally:
+        lammps_service._runner = runner
+    
+    # The kept trajectory is moved to the simulations directory under its file ID
+    xyz_file = None
+    if result["success"]:
+        xyz_file = lammps_service.simulations_dir / f"trajectory_{result['analysis']['trajectory_file_id']}.xyz"
+    return result, "".join(logs), xyz_file, elapsed
+
 @pytest.mark.integration
-def test_real_lammps_docker_simulation(lammps_service, simple_lammps_input):
+def test_real_lammps_docker_simulation(lammps_trajectory):
     """
     Integration test that runs a real LAMMPS simulation using Docker.
     
-    This test requires Docker to be running and the lammps/lammps image to be available.
+    This test requires Docker to be running; the LAMMPS image is built from backend/Dockerfile if needed.
     """
-    # Skip if Docker is not available
-    try:
-        import docker
-        client = docker.from_env()
-        client.ping()  # Check if Docker daemon is responsive
-    except Exception as e:
-        pytest.skip(f"Docker not available: {str(e)}")
+    result, log, xyz_file, elapsed = lammps_trajectory
     
-    # Check if LAMMPS image is available
-    try:
-        client.images.get("lammps/lammps:latest")
-    except docker.errors.ImageNotFound:
-        pytest.skip("LAMMPS Docker image not found. Pull it with 'docker pull lammps/lammps:latest'")
-    
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Create input file
-        input_file = Path(tmpdir) / "in.lj"
-        lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        # Run the simulation with Docker
-        start_time = time.time()
-        result = lammps_service.run_simulation(input_file)
-        end_time = time.time()
-        
-        # Verify the simulation was successful
-        assert result["success"] is True, f"Simulation failed: {result.get('message', 'Unknown error')}"
-        
-        # Verify output files exist
-        xyz_file = Path(tmpdir) / "simulation.xyz"
-        assert xyz_file.exists(), "XYZ output file not created"
-        assert xyz_file.stat().st_size > 0, "XYZ output file is empty"
-        
-        # Verify the simulation log contains expected LAMMPS output
-        assert "LAMMPS" in result["log"], "LAMMPS signature not found in simulation log"
-        assert "Step" in result["log"], "Timestep information not found in simulation log"
-        assert "Loop time" in result["log"], "Simulation timing information not found in log"
+    # Verify the simulation was successful
+    assert result["success"] is True, f"Simulation failed: {result.get('message', 'Unknown error')}"
+    
+    # Verify the simulation log contains expected LAMMPS output
+    assert "LAMMPS" in log, "LAMMPS signature not found in simulation log"
+    assert "Step" in log, "Timestep information not found in simulation log"
+    assert "Loop time" in log, "Simulation timing information not found in log"
+    
+    # Verify the output file exists and is not empty, opening it once for all checks
+    assert xyz_file.exists(), "XYZ output file not created"
+    with open(xyz_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        assert size > 0, "XYZ output file is empty"
         
-        # Print some information about the simulation
-        print(f"\nLAMMPS simulation completed in {end_time - start_time:.2f} seconds")
-        print(f"Output file size: {xyz_file.stat().st_size} bytes")
+        # Log some information about the simulation
+        logger.debug("LAMMPS simulation completed in %.2f seconds", elapsed)
+        logger.debug("Output file size: %d bytes", size)
         
-        # Verify the XYZ file format is correct
-        with open(xyz_file, 'r') as f:
-            lines = f.readlines()
-            assert len(lines) > 0, "XYZ file is empty"
-            assert lines[0].strip().isdigit(), "First line should be the number of atoms"
-            atom_count = int(lines[0].strip())
+        # Verify the XYZ file format is correct without reading it into a list of lines
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            first_line = buf[:buf.find(b"\n")].strip()
+            assert first_line.isdigit(), "First line should be the number of atoms"
+            atom_count = int(first_line)
             assert atom_count > 0, "No atoms in the simulation"
             
-            # Check that we have the expected number of frames
             # Each frame has atom_count + 2 lines (atom count, comment, and atom_count lines of coordinates)
             frame_size = atom_count + 2
+            f.seek(0)
+            frames = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b"")) // frame_size
             expected_frames = 11  # Initial + 10 frames (every 10 steps for 100 steps)
             
             # Allow for some flexibility in the number of frames
-            min_expected_lines = frame_size * (expected_frames - 1)
-            assert len(lines) >= min_expected_lines, f"XYZ file has fewer frames than expected: {len(lines)} lines, expected at least {min_expected_lines}"
+            assert frames >= expected_frames - 1, f"XYZ file has fewer frames than expected: {frames}, expected at least {expected_frames - 1}"
 
 @pytest.mark.integration
-def test_real_lammps_analysis_pipeline(lammps_service, ase_service, simple_lammps_input):
+def test_real_lammps_analysis_pipeline(ase_service, lammps_trajectory):
     """
     Integration test for the full simulation and analysis pipeline using real Docker containers.
     
-    This test runs a LAMMPS simulation and then analyzes the results with ASE.
+    This test analyzes the shared LAMMPS simulation output with ASE.
     """
-    # Skip if Docker is not available
-    try:
-        import docker
-        client = docker.from_env()
-        client.ping()
-    except Exception as e:
-        pytest.skip(f"Docker not available: {str(e)}")
+    result, _, xyz_file, _ = lammps_trajectory
+    assert result["success"] is True, f"Simulation failed: {result.get('message', 'Unknown error')}"
     
-    # Check if LAMMPS image is available
-    try:
-        client.images.get("lammps/lammps:latest")
-    except docker.errors.ImageNotFound:
-        pytest.skip("LAMMPS Docker image not found. Pull it with 'docker pull lammps/lammps:latest'")
-    
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Create input file
-        input_file = Path(tmpdir) / "in.lj"
-        lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        # Run the simulation
-        result = lammps_service.run_simulation(input_file)
-        assert result["success"] is True, f"Simulation failed: {result.get('message', 'Unknown error')}"
-        
-        # Verify output files exist
-        xyz_file = Path(tmpdir) / "simulation.xyz"
-        assert xyz_file.exists(), "XYZ output file not created"
-        
-        # Print the contents of the XYZ file for debugging
-        print("\nXYZ file contents:")
+    # Verify output files exist
+    assert xyz_file.exists(), "XYZ output file not created"
+    
+    # Log the start of the XYZ file for debugging (only read when DEBUG is enabled)
+    if logger.isEnabledFor(logging.DEBUG):
         with open(xyz_file, 'r') as f:
-            xyz_content = f.read()
-            print(xyz_content[:500])  # Print first 500 characters
-            
-        # Check file size
-        file_size = xyz_file.stat().st_size
-        print(f"XYZ file size: {file_size} bytes")
-        
-        # Analyze the results with ASE
-        analysis_result = ase_service.analyze_trajectory(xyz_file)
-        
-        # Print analysis result for debugging
-        print(f"Analysis result: {analysis_result}")
-        
-        # Verify analysis results
-        assert "msd" in analysis_result, "Mean square displacement not calculated"
-        assert "potential_energy" in analysis_result, "Potential energy not calculated"
-        assert len(analysis_result["msd"]) > 0, "MSD data is empty"
-        assert len(analysis_result["potential_energy"]) > 0, "Potential energy data is empty"
-        
-        # Verify that the analysis results can be serialized to JSON
-        json_result = json.dumps(analysis_result)
-        assert isinstance(json_result, str), "Analysis results cannot be serialized to JSON"
-        
-        # Print some information about the analysis
-        print(f"\nTrajectory analysis completed")
-        print(f"Number of frames analyzed: {len(analysis_result['msd'])}")
-        print(f"Final MSD value: {analysis_result['msd'][-1]}") 
\ No newline at end of file
+            logger.debug("XYZ file contents:\n%s", f.read(500))
+        logger.debug("XYZ file size: %d bytes", xyz_file.stat().st_size)
+    
+    # Analyze the results with ASE
+    analysis_result = ase_service.analyze_trajectory(xyz_file)
+    
+    # Log analysis result for debugging
+    logger.debug("Analysis result: %s", analysis_result)
+    
+    # Verify analysis results
+    assert "msd" in analysis_result, "Mean square displacement not calculated"
+    assert "potential_energy" in analysis_result, "Potential energy not calculated"
+    assert len(analysis_result["msd"]) > 0, "MSD data is empty"
+    assert len(analysis_result["potential_energy"]) > 0, "Potential energy data is empty"
+    
+    # Verify that the analysis results can be serialized to JSON
+    json_result = orjson.dumps(analysis_result, option=orjson.OPT_SERIALIZE_NUMPY)
+    assert isinstance(json_result, (bytes, str)), "Analysis results cannot be serialized to JSON"
+    
+    # Log some information about the analysis
+    logger.debug("Trajectory analysis completed")
+    logger.debug("Number of frames analyzed: %d", len(analysis_result["msd"]))
+    logger.debug("Final MSD value: %s", analysis_result["msd"][-1]) 
\ No newline at end of file
@@ -1,31 +1,63 @@
 import os
+import asyncio
+import queue
 import pytest
-import tempfile
-import json
+import shutil
+import orjson
+import hashlib
+import numpy as np
 from pathlib import Path
+from types import MappingProxyType
 from unittest.mock import patch, MagicMock
 
 from app.services.lammps_service import LAMMPSService
 from app.services.ase_service import ASEService
 
-@pytest.fixture(autouse=True)
+# Mock simulation output: one frame of four argon atoms
+MOCK_XYZ = b"4\nAtoms\nAr 0.0 0.0 0.0\nAr 1.0 0.0 0.0\nAr 0.0 1.0 0.0\nAr 0.0 0.0 1.0\n"
+
+# Environment the module-scoped services are built under, read-only as every test shares them
+SERVICE_ENV = MappingProxyType({"TESTING": "true"})
+
+# Canned run_simulation results for invalid inputs, keyed on the input filename (read-only, shared)
+INVALID_RESPONSES = MappingProxyType({
+    "invalid.lj": MappingProxyType({
+        "success": False,
+        "message": "Simulation failed: Invalid input file",
+        "output_files": (),
+        "log": "ERROR: Unknown command: invalid_command"
+    }),
+})
+
+# Trajectory analyses keyed by the SHA-256 of the XYZ content, so copies in different tmp dirs share a result
+_ANALYSIS_CACHE = {}
+
+def _analyze_xyz(xyz_file):
+    """Analyze an XYZ file, reusing the result for identical content across tests."""
+    digest = hashlib.sha256(xyz_file.read_bytes()).hexdigest()
+    if digest not in _ANALYSIS_CACHE:
+        _ANALYSIS_CACHE[digest] = ASEService().analyze_trajectory(xyz_file)
+    return _ANALYSIS_CACHE[digest]
+
+@pytest.fixture(scope="module", autouse=True)
 def setup_test_env():
     """Set up test environment."""
-    os.environ['TESTING'] = 'true'
+    os.environ.update(SERVICE_ENV)
     yield
-    os.environ.pop('TESTING', None)
+    for name in SERVICE_ENV:
+        os.environ.pop(name, None)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def lammps_service():
     """Fixture to create a LAMMPS service instance."""
     return LAMMPSService()
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def ase_service():
     """Fixture to create an ASE service instance."""
     return ASEService()
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def simple_lammps_input():
     """Fixture to create a simple LAMMPS input file for testing."""
     return """
@@ -64,15 +96,26 @@ timestep        0.005
 run             1000
 """
 
-@pytest.fixture
+@pytest.fixture(scope="module")
+def simple_lammps_input_path(tmp_path_factory, simple_lammps_input):
+    """Fixture to write the simple LAMMPS input once per module."""
+    path = tmp_path_factory.mktemp("lammps") / "in.lj"
+    path.write_text(simple_lammps_input)
+    return path
+
+@pytest.fixture(scope="module")
 def mock_docker_container():
     """Mock Docker container for testing."""
     container_mock = MagicMock()
-    container_mock.logs.return_value = b"LAMMPS simulation completed successfully"
+    # Like the Docker SDK, stream=True yields chunks lazily instead of returning all bytes
+    container_mock.logs.side_effect = lambda **kwargs: (
+        iter([b"LAMMPS ", b"simulation ", b"completed successfully\n"]) if kwargs.get("stream")
+        else b"LAMMPS simulation completed successfully"
+    )
     container_mock.wait.return_value = {"StatusCode": 0}
     return container_mock
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_docker_client(mock_docker_container):
     """Mock Docker client for testing."""
     client_mock = MagicMock()
@@ -81,8 +124,15 @@ def mock_docker_client(mock_docker_container):
     client_mock.containers = containers_mock
     return client_mock
 
-@pytest.fixture
-def patched_lammps_service(mock_docker_client):
+@pytest.fixture(scope="session")
+def master_xyz(tmp_path_factory):
+    """Write the mock XYZ output once per test session."""
+    path = tmp_path_factory.mktemp("xyz") / "master.xyz"
+    path.write_bytes(MOCK_XYZ)
+    return path
+
+@pytest.fixture(scope="module")
+def patched_lammps_service(mock_docker_client, master_xyz):
     """Patch LAMMPSService to use mock Docker client."""
     with patch('docker.from_env', return_value=mock_docker_client):
         service = LAMMPSService()
@@ -92,15 +142,12 @@ def patched_lammps_service(mock_docker_client):
             sim_dir = service.simulations_dir / "mock_sim"
             sim_dir.mkdir(parents=True, exist_ok=True)
             
-            # Create a mock XYZ file
+            # Create a mock XYZ file sharing the master file's inode
             xyz_file = Path(input_file_path).parent / "simulation.xyz"
-            with open(xyz_file, 'w') as f:
-                f.write("4\n")  # Number of atoms
-                f.write("Atoms\n")
-                f.write("Ar 0.0 0.0 0.0\n")
-                f.write("Ar 1.0 0.0 0.0\n")
-                f.write("Ar 0.0 1.0 0.0\n")
-                f.write("Ar 0.0 0.0 1.0\n")
+            try:
+                os.link(master_xyz, xyz_file)
+            except OSError:
+                xyz_file.write_bytes(MOCK_XYZ)
             
             return {
                 "success": True,
@@ -111,102 +158,91 @@ def patched_lammps_service(mock_docker_client):
         
         # Replace the actual run_simulation method with our mock
         service.run_simulation = mock_run_simulation
-        return service
+        yield service
 
-def test_lammps_service_create_input_file(lammps_service, simple_lammps_input):
+def test_lammps_service_create_input_file(lammps_service, simple_lammps_input, tmp_path):
     """Test that the LAMMPS service can create an input file."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "in.lj"
-        lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        assert input_file.exists()
-        with open(input_file, 'r') as f:
-            content = f.read()
-        assert content == simple_lammps_input
+    input_file = tmp_path / "in.lj"
+    lammps_service.create_input_file(simple_lammps_input, input_file)
+    
+    assert input_file.exists()
+    with open(input_file, 'r') as f:
+        content = f.read()
+    assert content == simple_lammps_input
 
-def test_lammps_service_run_simulation(patched_lammps_service, simple_lammps_input):
+def test_lammps_service_run_simulation(patched_lammps_service, simple_lammps_input_path, tmp_path):
     """Test that the LAMMPS service can run a simulation."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "in.lj"
-        patched_lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        result = patched_lammps_service.run_simulation(input_file)
-        
-        assert result["success"] is True
-        assert Path(tmpdir, "simulation.xyz").exists()
+    input_file = tmp_path / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    result = patched_lammps_service.run_simulation(input_file)
+    
+    assert result["success"] is True
+    assert (tmp_path / "simulation.xyz").exists()
 
-def test_ase_service_analyze_xyz(patched_lammps_service, ase_service, simple_lammps_input):
+def test_ase_service_analyze_xyz(patched_lammps_service, simple_lammps_input_path, tmp_path):
     """Test that the ASE service can analyze simulation output."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "in.lj"
-        patched_lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        result = patched_lammps_service.run_simulation(input_file)
-        assert result["success"] is True
-        
-        # Now analyze the output with ASE
-        xyz_file = Path(tmpdir, "simulation.xyz")
-        analysis_result = ase_service.analyze_trajectory(xyz_file)
-        
-        # Check that we got some analysis results
-        assert "msd" in analysis_result
-        assert "potential_energy" in analysis_result
-        assert len(analysis_result["msd"]) > 0
-        assert len(analysis_result["potential_energy"]) > 0
+    input_file = tmp_path / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    result = patched_lammps_service.run_simulation(input_file)
+    assert result["success"] is True
+    
+    # Now analyze the output with ASE
+    xyz_file = tmp_path / "simulation.xyz"
+    analysis_result = _analyze_xyz(xyz_file)
+    
+    # Check that we got some analysis results
+    assert "msd" in analysis_result
+    assert "potential_energy" in analysis_result
+    assert len(analysis_result["msd"]) > 0
+    assert len(analysis_result["potential_energy"]) > 0
 
-def test_full_simulation_pipeline(patched_lammps_service, ase_service, simple_lammps_input):
+def test_full_simulation_pipeline(patched_lammps_service, simple_lammps_input_path, tmp_path):
     """Test the full simulation pipeline from input to analysis."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Create the input file
-        input_file = Path(tmpdir) / "in.lj"
-        patched_lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        # Run the simulation
-        sim_result = patched_lammps_service.run_simulation(input_file)
-        assert sim_result["success"] is True
-        
-        # Analyze the results
-        xyz_file = Path(tmpdir, "simulation.xyz")
-        analysis_result = ase_service.analyze_trajectory(xyz_file)
-        
-        # Check for expected data in the results
-        assert "msd" in analysis_result
-        assert "potential_energy" in analysis_result
-        
-        # Verify that the output can be serialized to JSON
-        json_result = json.dumps(analysis_result)
-        assert isinstance(json_result, str)
+    # Create the input file
+    input_file = tmp_path / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    # Run the simulation
+    sim_result = patched_lammps_service.run_simulation(input_file)
+    assert sim_result["success"] is True
+    
+    # Analyze the results
+    xyz_file = tmp_path / "simulation.xyz"
+    analysis_result = _analyze_xyz(xyz_file)
+    
+    # Check for expected data in the results
+    assert "msd" in analysis_result
+    assert "potential_energy" in analysis_result
+    
+    # Verify that the output can be serialized to JSON
+    json_result = orjson.dumps(analysis_result, option=orjson.OPT_SERIALIZE_NUMPY)
+    assert isinstance(json_result, (bytes, str))
 
-def test_invalid_input_file(lammps_service):
+def test_invalid_input_file(lammps_service, tmp_path, monkeypatch):
     """Test that the LAMMPS service handles invalid input files appropriately."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "invalid.lj"
-        invalid_input = """
-        # Invalid LAMMPS input
-        invalid_command
-        nonsense_parameters
-        """
-        lammps_service.create_input_file(invalid_input, input_file)
-        
-        # Mock the run_simulation method to simulate failure for invalid input
-        original_run_simulation = lammps_service.run_simulation
-        
-        def mock_invalid_run(input_path):
-            if "invalid.lj" in str(input_path):
-                return {
-                    "success": False,
-                    "message": "Simulation failed: Invalid input file",
-                    "output_files": [],
-                    "log": "ERROR: Unknown command: invalid_command"
-                }
-            return original_run_simulation(input_path)
-        
-        # Apply the mock
-        lammps_service.run_simulation = mock_invalid_run
-        
-        result = lammps_service.run_simulation(input_file)
-        assert result["success"] is False
-        assert "failed" in result["message"].lower()
+    input_file = tmp_path / "invalid.lj"
+    invalid_input = """
+    # Invalid LAMMPS input
+    invalid_command
+    nonsense_parameters
+    """
+    lammps_service.create_input_file(invalid_input, input_file)
+    
+    # Mock the run_simulation method to simulate failure for invalid input
+    original_run_simulation = lammps_service.run_simulation
+    
+    def mock_invalid_run(input_path):
+        response = INVALID_RESPONSES.get(Path(input_path).name)
+        return response if response is not None else original_run_simulation(input_path)
+    
+    # Apply the mock (undone after the test, as the service is shared by the module)
+    monkeypatch.setattr(lammps_service, "run_simulation", mock_invalid_run)
+    
+    result = lammps_service.run_simulation(input_file)
+    assert result["success"] is False
+    assert "failed" in result["message"].lower()
 
 def test_environment_detection(monkeypatch):
     """Test that the service correctly detects if it's running in Docker."""
@@ -222,37 +258,387 @@ def test_environment_detection(monkeypatch):
     assert local_service.in_docker is False
     assert local_service.lammps_exec == "lmp"
 
-def test_output_file_validation(patched_lammps_service, simple_lammps_input):
+def test_output_file_validation(patched_lammps_service, simple_lammps_input_path, tmp_path):
     """Test that all expected output files are generated and valid."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "in.lj"
-        patched_lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        result = patched_lammps_service.run_simulation(input_file)
-        assert result["success"] is True
+    input_file = tmp_path / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    result = patched_lammps_service.run_simulation(input_file)
+    assert result["success"] is True
+    
+    # Verify output files exist and are not empty (one directory listing, cached stats)
+    with os.scandir(tmp_path) as it:
+        entries = {entry.name: entry for entry in it}
+    for output_file in result["output_files"]:
+        name = Path(output_file).name
+        assert name in entries
+        assert entries[name].stat().st_size > 0
         
-        # Verify output files exist and are not empty
-        for output_file in result["output_files"]:
-            path = Path(output_file)
-            assert path.exists()
-            assert path.stat().st_size > 0
-            
-        # Verify XYZ file format
-        xyz_file = Path(tmpdir) / "simulation.xyz"
-        with open(xyz_file, 'r') as f:
-            first_line = f.readline()
-            assert first_line.strip().isdigit(), "First line should contain number of atoms"
+    # Verify XYZ file format
+    xyz_file = tmp_path / "simulation.xyz"
+    with open(xyz_file, 'r') as f:
+        first_line = f.readline()
+        assert first_line.strip().isdigit(), "First line should contain number of atoms"
 
-def test_simulation_cleanup(patched_lammps_service, simple_lammps_input):
+def test_simulation_cleanup(patched_lammps_service, simple_lammps_input_path, tmp_path):
     """Test that temporary files are cleaned up after simulation."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_file = Path(tmpdir) / "in.lj"
-        patched_lammps_service.create_input_file(simple_lammps_input, input_file)
-        
-        sim_dir_before = set(Path(patched_lammps_service.simulations_dir).glob("*"))
-        result = patched_lammps_service.run_simulation(input_file)
-        sim_dir_after = set(Path(patched_lammps_service.simulations_dir).glob("*"))
+    input_file = tmp_path / "in.lj"
+    shutil.copy(simple_lammps_input_path, input_file)
+    
+    sim_dir_before = set(Path(patched_lammps_service.simulations_dir).glob("*"))
+    result = patched_lammps_service.run_simulation(input_file)
+    sim_dir_after = set(Path(patched_lammps_service.simulations_dir).glob("*"))
+    
+    # Verify that no temporary files remain
+    assert sim_dir_before == sim_dir_after
+    assert result["success"] is True
+
+
+def test_ase_service_calculate_msd(ase_service):
+    """Test that the MSD is the mean squared displacement from the first frame."""
+    positions = np.array([
+        [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]],
+        [[1.0, 0.0, 0.0], [1.0, 0.0, 0.0]],
+        [[1.0, 1.0, 0.0], [1.0, 0.0, 2.0]],
+    ])
+    
+    msd = ase_service._calculate_msd(positions)
+    
+    assert msd.tolist() == [0.0, 0.5, 3.0]
+
+def test_ase_service_calculate_msd_fft(ase_service):
+    """Test that the FFT MSD averages the squared displacement over all time origins."""
+    positions = np.array([
+        [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]],
+        [[1.0, 0.0, 0.0], [1.0, 0.0, 0.0]],
+        [[1.0, 1.0, 0.0], [1.0, 0.0, 2.0]],
+    ])
+    
+    msd = ase_service._calculate_msd_fft(positions)
+    
+    assert msd == pytest.approx([0.0, 1.5, 3.0])
+
+def test_ase_service_calculate_kinetic_energy(ase_service):
+    """Test kinetic energy from velocities, falling back to stored values or 0.0."""
+    velocities = np.array([
+        [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0]],
+        np.full((2, 3), np.nan),
+        np.full((2, 3), np.nan),
+    ])
+    masses = np.full((3, 2), 2.0)
+    stored = np.array([np.nan, 7.0, np.nan])
+    
+    kinetic_energy = ase_service._calculate_kinetic_energy(velocities, masses, stored)
+    
+    assert kinetic_energy[0] == pytest.approx(0.5 * 2.0 * 5.0)
+    assert kinetic_energy[1] == pytest.approx(7.0)
+    assert kinetic_energy[2] == 0.0
+
+def test_ase_service_parse_xyz_manually(ase_service, tmp_path):
+    """Test manual XYZ parsing of numeric types and skipping of malformed frames."""
+    xyz_file = tmp_path / "trajectory.xyz"
+    xyz_file.write_text(
+        "2\nframe 0\n1 0.0 0.0 0.0\n1 1.0 0.0 0.0\n"
+        "2\nframe 1\nAr 0.0 0.0 0.0\nAr 1.0 bad 0.0\n"
+        "2\nframe 2\nAr 0.0 0.0 0.5\nAr 1.0 1.0 1.0\n"
+    )
+    
+    trajectory = ase_service._parse_xyz_manually(xyz_file)
+    
+    assert len(trajectory) == 2
+    assert trajectory[0].get_chemical_symbols() == ["Ar", "Ar"]
+    assert trajectory[1].get_positions().tolist() == [[0.0, 0.0, 0.5], [1.0, 1.0, 1.0]]
+
+def test_ase_service_parse_xyz_positions(ase_service, tmp_path):
+    """Test parsing XYZ positions into a stacked array without Atoms objects."""
+    xyz_file = tmp_path / "trajectory.xyz"
+    xyz_file.write_text(
+        "2\nframe 0\n1 0.0 0.0 0.0\n1 1.0 0.0 0.0\n"
+        "2\nframe 1\n1 0.5 0.0 0.0\n1 1.0 2.0 0.0\n"
+    )
+    
+    positions, symbols = ase_service._parse_xyz_positions(xyz_file)
+    
+    assert positions.shape == (2, 2, 3)
+    assert positions[1].tolist() == [[0.5, 0.0, 0.0], [1.0, 2.0, 0.0]]
+    assert symbols == ["Ar", "Ar"]
+
+def test_ase_service_parse_velocity_file(ase_service, tmp_path):
+    """Test parsing a LAMMPS custom dump with velocities."""
+    velocity_file = tmp_path / "dump.vel"
+    frame = (
+        "ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n2\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0 1\n0 1\n0 1\n"
+        "ITEM: ATOMS id type vx vy vz\n2 1 0.0 0.0 {v}\n1 1 {v} 0.0 0.0\n"
+    )
+    velocity_file.write_text(frame.format(step=0, v=1.0) + frame.format(step=10, v=2.0))
+    
+    velocities = ase_service._parse_velocity_file(velocity_file)
+    
+    assert len(velocities) == 2
+    assert velocities[0].tolist() == [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+    assert velocities[1].tolist() == [[2.0, 0.0, 0.0], [0.0, 0.0, 2.0]]
+
+def test_ase_service_parse_velocity_file_bounds_process_pool(tmp_path, monkeypatch):
+    """Test that large velocity dumps are parsed in bounded batches by one long-lived pool."""
+    from concurrent.futures import ThreadPoolExecutor
+    pools = []
+    
+    def pool(max_workers=None, mp_context=None):
+        pools.append(max_workers)
+        return ThreadPoolExecutor(max_workers=max_workers)
+    
+    monkeypatch.setattr("app.services.ase_service.VELOCITY_PARALLEL_MIN_SIZE", 0)
+    monkeypatch.setattr("app.services.ase_service.VELOCITY_BATCH_SIZE", 2)
+    monkeypatch.setattr("app.services.ase_service.ProcessPoolExecutor", pool)
+    frame = (
+        "ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n1\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0 1\n0 1\n0 1\n"
+        "ITEM: ATOMS id type vx vy vz\n1 1 {v} 0.0 0.0\n"
+    )
+    velocity_file = tmp_path / "dump.vel"
+    velocity_file.write_text(
+        "".join(frame.format(step=step, v=float(step)) for step in range(3))
+        + "ITEM: TIMESTEP\n3\n"  # Truncated frame
+        + frame.format(step=4, v=4.0)
+    )
+    
+    service = ASEService()
+    velocities = service._parse_velocity_file(velocity_file)
+    service._parse_velocity_file(velocity_file)
+    service.close()
+    
+    # The truncated frame keeps its place as an empty placeholder
+    assert [v.tolist() for v in velocities] == [[[0.0, 0.0, 0.0]], [[1.0, 0.0, 0.0]], [[2.0, 0.0, 0.0]], [], [[4.0, 0.0, 0.0]]]
+    assert pools == [min(4, os.cpu_count() or 1)]
+    assert service._velocity_pool is None
+
+def test_ase_service_analyze_trajectory_streams_chunks(ase_service, tmp_path, monkeypatch):
+    """Test that chunked single-pass analysis matches the whole-trajectory results."""
+    monkeypatch.setattr("app.services.ase_service.FRAME_CHUNK_SIZE", 2)
+    xyz_file = tmp_path / "trajectory.xyz"
+    xyz_file.write_text(
+        "2\nframe 0\nAr 0.0 0.0 0.0\nAr 1.0 0.0 0.0\n"
+        "2\nframe 1\nAr 1.0 0.0 0.0\nAr 1.0 0.0 0.0\n"
+        "2\nframe 2\nAr 1.0 1.0 0.0\nAr 1.0 0.0 2.0\n"
+    )
+    velocity_file = tmp_path / "dump.vel"
+    frame = (
+        "ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n2\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0 1\n0 1\n0 1\n"
+        "ITEM: ATOMS id vx vy vz\n1 1.0 0.0 0.0\n2 0.0 1.0 0.0\n"
+    )
+    velocity_file.write_text("".join(frame.format(step=step) for step in range(3)))
+    
+    result = ase_service.analyze_trajectory(xyz_file, velocity_file)
+    
+    assert result["frames"] == 3
+    assert result["atoms"] == 2
+    assert result["msd"].tolist() == [0.0, 0.5, 3.0]
+    assert result["kinetic_energy"].tolist() == pytest.approx([39.948] * 3, rel=1e-6)
+
+def test_ase_service_analyze_frames_reuses_masses_per_composition(ase_service):
+    """Test that cached masses are only reused for frames with the same composition."""
+    from ase import Atoms
+    
+    frames = []
+    for symbols in ("Ar2", "Ar2", "He2"):
+        atoms = Atoms(symbols, positions=[[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+        atoms.set_velocities([[1.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+        frames.append(atoms)
+    
+    result = ase_service._analyze_frames(frames)
+    
+    assert result["kinetic_energy"] == pytest.approx(
+        [atoms.get_masses().sum() * 0.5 for atoms in frames], rel=1e-6
+    )
+
+def test_parse_velocity_block(tmp_path):
+    """Test splitting a velocity dump into frame blocks and parsing each independently."""
+    from app.services.ase_service import _iter_velocity_blocks, _parse_velocity_block
+    
+    velocity_file = tmp_path / "dump.vel"
+    frame = (
+        "ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n2\n"
+        "ITEM: BOX BOUNDS pp pp pp\n0 1\n0 1\n0 1\n"
+        "ITEM: ATOMS vx vy vz id\n0.0 {v} 0.0 2\n{v} 0.0 0.0 1\n"
+    )
+    velocity_file.write_text(frame.format(step=0, v=1.0) + frame.format(step=10, v=3.0))
+    
+    blocks = list(_iter_velocity_blocks(velocity_file))
+    
+    assert len(blocks) == 2
+    assert _parse_velocity_block(blocks[1]).tolist() == [[3.0, 0.0, 0.0], [0.0, 3.0, 0.0]]
+    assert _parse_velocity_block(b"\n0\n").shape == (0, 3)
+
+def test_validate_input_file_required_commands(lammps_service):
+    """Test that required commands are matched as whole words in a single scan."""
+    base = "units lj\natom_style atomic\n{run}\ndump 1 all xyz 10 traj.xyz\n"
+    
+    assert lammps_service.validate_input_file(base.format(run="run 100")) == (True, "Input file is valid")
+    assert lammps_service.validate_input_file(base.format(run="run_style verlet")) == (
+        False, "Missing required commands: run"
+    )
+    assert lammps_service.validate_input_file("units lj\natom_style atomic\nrun 100\n") == (
+        False, "Missing dump command for trajectory output"
+    )
+    
+    # Validation reports whether masses are set so run_simulation can skip re-checking
+    assert lammps_service._validate_input(base.format(run="run 100"))[2] == {"masses_present": False}
+    assert lammps_service._validate_input(base.format(run="mass 1 1.0\nrun 100"))[2] == {"masses_present": True}
+
+def test_ensure_masses_set_inserts_after_create_atoms(lammps_service):
+    """Test that default masses are spliced in right after the create_atoms line."""
+    content = "create_box 2 box\ncreate_atoms 1 box\nrun 100\n"
+    
+    result = lammps_service.ensure_masses_set(content)
+    
+    assert result == (
+        "create_box 2 box\ncreate_atoms 1 box\n\n"
+        "mass 1 1.0  # Default mass added automatically\n"
+        "mass 2 1.0  # Default mass added automatically\n\n"
+        "run 100\n"
+    )
+    assert lammps_service.ensure_masses_set(result) == result
+
+class _FakeLammpsProcess:
+    """Stand-in for the LAMMPS subprocess that writes dump files into its working directory."""
+    
+    def __init__(self, cmd, cwd=None, **kwargs):
+        self.returncode = 0
+        sim_dir = Path(cwd)
+        _FakeLammpsProcess.linked_potential = (sim_dir / "Ar.eam").is_symlink()
+        (sim_dir / "custom_name.xyz").write_text(
+            "2\nframe 0\nAr 0.0 0.0 0.0\nAr 1.0 0.0 0.0\n"
+            "2\nframe 1\nAr 1.0 0.0 0.0\nAr 1.0 0.0 0.0\n"
+        )
+        (sim_dir / "dump.vel").write_text("".join(
+            f"ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n2\n"
+            "ITEM: BOX BOUNDS pp pp pp\n0 1\n0 1\n0 1\n"
+            "ITEM: ATOMS id vx vy vz\n1 1.0 0.0 0.0\n2 0.0 1.0 0.0\n"
+            for step in (0, 10)
+        ))
+    
+    def wait(self):
+        return self.returncode
+
+def test_run_local_simulation_finds_output_files(lammps_service, tmp_path, monkeypatch):
+    """Test that dump files are located and analyzed after a local run."""
+    input_file = tmp_path / "input.lammps"
+    input_file.write_text("units lj\n")
+    (tmp_path / "Ar.eam").write_text("potential")
+    monkeypatch.setattr("app.services.lammps_service.subprocess.Popen", _FakeLammpsProcess)
+    
+    run_dirs_before = set(lammps_service.simulations_dir.glob("sim_*"))
+    result = lammps_service._run_local_simulation(input_file, "units lj\n", "missing.xyz", "dump.vel")
+    
+    assert result["success"] is True
+    analysis = result["analysis"]
+    assert analysis["frames"] == 2
+    assert analysis["msd"].tolist() == [0.0, 0.5]
+    assert not np.isnan(analysis["kinetic_energy"]).any()
+    assert (lammps_service.simulations_dir / f"trajectory_{analysis['trajectory_file_id']}.xyz").exists()
+    assert set(lammps_service.simulations_dir.glob("sim_*")) == run_dirs_before
+    assert _FakeLammpsProcess.linked_potential
+    
+    # The analysis service is created once and reused by later runs
+    ase = lammps_service._ase
+    assert isinstance(ase, ASEService)
+    lammps_service._run_local_simulation(input_file, "units lj\n", "missing.xyz", "dump.vel")
+    assert lammps_service._ase is ase
+    assert (tmp_path / "Ar.eam").read_text() == "potential"
+
+def test_run_local_simulation_reports_stderr_tail(lammps_service, tmp_path, monkeypatch):
+    """Test that a failed run reports only the end of the streamed stderr."""
+    class FailingProcess:
+        def __init__(self, cmd, stdout=None, stderr=None, cwd=None):
+            stderr.write(b"x" * 100000 + b"ERROR: Unknown command")
+            self.returncode = 1
         
-        # Verify that no temporary files remain
-        assert sim_dir_before == sim_dir_after
-        assert result["success"] is True 
\ No newline at end of file
+        def wait(self):
+            return self.returncode
+    
+    monkeypatch.setattr("app.services.lammps_service.subprocess.Popen", FailingProcess)
+    input_file = tmp_path / "input.lammps"
+    input_file.write_text("units lj\n")
+    
+    result = lammps_service._run_local_simulation(input_file, "units lj\n")
+    
+    assert result["success"] is False
+    assert result["message"].endswith("ERROR: Unknown command")
+    assert len(result["message"]) < 70 * 1024
+
+def test_run_simulation_async_pins_pool_workers(tmp_path, monkeypatch):
+    """Test that pooled runs are bounded and each gets its own CPU slot."""
+    service = LAMMPSService(max_workers=1)
+    service._cpu_slots = queue.Queue()
+    service._cpu_slots.put([2, 3])
+    service._taskset = "/usr/bin/taskset"
+    commands = []
+    
+    class RecordingProcess(_FakeLammpsProcess):
+        def __init__(self, cmd, **kwargs):
+            commands.append(cmd)
+            super().__init__(cmd, **kwargs)
+    
+    monkeypatch.setattr("app.services.lammps_service.subprocess.Popen", RecordingProcess)
+    input_file = tmp_path / "input.lammps"
+    input_file.write_text(
+        "units lj\natom_style atomic\ndump 1 all xyz 10 custom_name.xyz\nrun 10\n"
+    )
+    
+    result = asyncio.run(service.run_simulation_async(input_file))
+    service.close()
+    
+    assert result["success"] is True
+    assert commands[0][:3] == ["/usr/bin/taskset", "-c", "2,3"]
+    assert service._cpu_slots.get_nowait() == [2, 3]
+
+def test_run_local_simulation_uses_injected_runner(tmp_path):
+    """Test that LAMMPS commands go through an injected runner."""
+    calls = []
+    
+    def runner(cmd, cwd, stdout, stderr):
+        calls.append((cmd, cwd))
+        stderr.write(b"ERROR: container run failed")
+        return 2
+    
+    service = LAMMPSService(runner=runner)
+    input_file = tmp_path / "input.lammps"
+    input_file.write_text("units lj\n")
+    
+    result = service._run_local_simulation(input_file, "units lj\n")
+    
+    assert result["message"] == "Simulation failed with exit code 2: ERROR: container run failed"
+    assert calls[0][0][-2:] == ["-in", str(Path(calls[0][1]) / "input.lammps")]
+    
+    # The logs of the failed run are kept, but not its run directory
+    run_dir = Path(calls[0][1])
+    kept_err = service.simulations_dir / f"failed_{run_dir.name[len('sim_'):]}_lammps.err"
+    assert not run_dir.exists()
+    assert kept_err.read_bytes() == b"ERROR: container run failed"
+    kept_err.unlink()
+    kept_err.with_name(kept_err.name.replace(".err", ".log")).unlink()
+
+def test_run_local_simulation_runs_in_scratch_dir(tmp_path):
+    """Test that LAMMPS runs in the scratch directory and kept outputs are moved out of it."""
+    scratch_dir = tmp_path / "scratch"
+    cwds = []
+    
+    def runner(cmd, cwd, stdout, stderr):
+        cwds.append(Path(cwd))
+        (Path(cwd) / "dump.xyz").write_bytes(MOCK_XYZ)
+        return 0
+    
+    service = LAMMPSService(runner=runner, scratch_dir=scratch_dir)
+    input_file = tmp_path / "input.lammps"
+    input_file.write_text("units lj\n")
+    
+    with patch("app.services.lammps_service.ASEService") as ase:
+        ase.return_value.analyze_trajectory.return_value = {"success": True}
+        result = service._run_local_simulation(input_file, "units lj\n", xyz_filename="dump.xyz")
+    
+    assert result["success"] is True
+    assert cwds[0].parent == scratch_dir
+    trajectory_id = result["analysis"]["trajectory_file_id"]
+    assert (service.simulations_dir / f"trajectory_{trajectory_id}.xyz").exists()
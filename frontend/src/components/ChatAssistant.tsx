@@ -27,6 +27,7 @@ const ChatAssistant: React.FC<ChatAssistantProps> = ({
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [showSuggestions, setShowSuggestions] = useState(true);
+  const [sessionId, setSessionId] = useState<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   // ポテンシャルファイルが選択されている場合、追加のメッセージを表示
@@ -81,7 +82,10 @@ const ChatAssistant: React.FC<ChatAssistantProps> = ({
       }
       
       // Call chat API
-      const response = await chatWithAssistant(enhancedInput, conversationHistory);
+      const response = await chatWithAssistant(enhancedInput, conversationHistory, sessionId);
+      if (response.session_id) {
+        setSessionId(response.session_id);
+      }
       
       // Add assistant response
       setMessages(prev => [
@@ -95,13 +95,23 @@ export const healthCheck = async (): Promise<{ status: string }> => {
 
 export const chatWithAssistant = async (
   message: string, 
-  conversationHistory: Array<{role: string, content: string}> = []
+  conversationHistory: Array<{role: string, content: string}> = [],
+  sessionId?: string | null
 ): Promise<ChatResponse> => {
   try {
-    const request: ChatRequest = { 
-      message, 
-      conversation_history: conversationHistory 
-    };
+    // Once the server holds the conversation, only the session ID needs to be sent
+    if (sessionId) {
+      try {
+        const response = await api.post<ChatResponse>('/api/chat', { message, session_id: sessionId });
+        return response.data;
+      } catch (error) {
+        // The session expired or is unknown to the server, so resend the full history
+        if (!(axios.isAxiosError(error) && error.response?.status === 404)) {
+          throw error;
+        }
+      }
+    }
+    const request: ChatRequest = { message, conversation_history: conversationHistory };
     const response = await api.post<ChatResponse>('/api/chat', request);
     return response.data;
   } catch (error) {
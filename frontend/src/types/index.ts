@@ -30,10 +30,12 @@ export interface InputFileResponse {
 export interface ChatRequest {
   message: string;
   conversation_history?: Array<{role: string, content: string}>;
+  session_id?: string;
 }
 
 // Chat response from the assistant
 export interface ChatResponse {
   response: string;
-  conversation_history: Array<{role: string, content: string}>;
+  conversation_history?: Array<{role: string, content: string}> | null;
+  session_id?: string;
 } 
\ No newline at end of file